@@ -3,12 +3,17 @@ from datetime import datetime, timedelta
 import time
 import json
 import os
-import yaml
 
 from utils import config
 from utils.auth import auth_manager
-from utils.retry import retry_with_backoff
-from utils.prometheus_metrics import API_REQUESTS, API_LATENCY
+from utils.session import citrix_session, response_json
+from utils.prometheus_metrics import get_api_counters
+
+# Optional incremental JSON parser used to stream very large responses
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 class CitrixAPIClient:
     def __init__(self):
@@ -18,6 +23,9 @@ class CitrixAPIClient:
         # Setup proxy configuration
         self.proxies = self._setup_proxies()
         
+        # Shared session: keeps TCP/TLS connections alive across all API calls
+        self.session = citrix_session
+        
         # Initialize site_id as None, will be set later
         self.site_id = None
         
@@ -64,10 +72,8 @@ class CitrixAPIClient:
         
         try:
             if os.path.exists(api_config_path):
-                with open(api_config_path, 'r') as f:
-                    configs = yaml.safe_load(f)
-                    config.logger.info(f"Loaded API configurations from {api_config_path}")
-                    return configs
+                # Shares the mtime-invalidated cache used by config.load_api_config
+                return config.load_yaml_cached(api_config_path)
             else:
                 config.logger.warning(f"API configuration file {api_config_path} not found, using fallback configuration")
                 return self._get_fallback_api_configs()
@@ -110,12 +116,13 @@ class CitrixAPIClient:
         Returns:
             dict: Headers dictionary
         """
-        headers = self.auth_manager.get_auth_header()
-        headers.update({
+        # The auth header dict is shared and cached by the auth manager, so build a new dict
+        headers = {
+            **self.auth_manager.get_auth_header(),
             'Accept': 'application/json',
             'Content-Type': 'application/json',
             'Citrix-CustomerId': self.customer_id
-        })
+        }
         
         # Add Citrix-InstanceId header for REST API calls when site_id is available
         if api_type == 'rest' and self.site_id:
@@ -132,10 +139,9 @@ class CitrixAPIClient:
             
         return headers
 
-    @retry_with_backoff()
-    def _make_request(self, method, endpoint, params=None, data=None, use_query_string=False, api_type=None):
+    def _make_request(self, method, endpoint, params=None, data=None, use_query_string=False, api_type=None, stream_items=False):
         """
-        Make a HTTP request to the Citrix API with retry logic.
+        Make a HTTP request to the Citrix API (transient failures are retried by the session adapter).
         
         Args:
             method: HTTP method (GET, POST, etc.)
@@ -144,7 +150,12 @@ class CitrixAPIClient:
             data: Request body
             use_query_string: If True, params is treated as a full query string
             api_type: Type of API ('rest' or 'odata')
+            stream_items: If True, large responses are returned as {'value': iterator}
+                and their 'value' items are parsed incrementally while being consumed
         """
+        # Streaming requires ijson and is skipped in debug mode, where the body is logged
+        stream_items = stream_items and ijson is not None and not config.DEBUG
+        
         # Se use_query_string è True, i parametri sono già formattati come una stringa di query
         if use_query_string and params:
             url = f"{self.base_url}{endpoint}?{params}"
@@ -169,45 +180,61 @@ class CitrixAPIClient:
         # Track API request latency using Prometheus histogram
         start_time = time.time()
         status = "success"
+        # Set when the body is handed to _stream_items, which then records the metrics itself
+        streamed = False
         
         try:
-            response = requests.request(
+            response = self.session.request(
                 method=method,
                 url=url,
                 headers=headers,
                 params=params,
                 json=data,
-                proxies=self.proxies
+                proxies=self.proxies,
+                stream=stream_items
             )
             
             # Handle 401 separately to refresh token
             if response.status_code == 401:
                 config.logger.warning("Authentication failed, requesting new token")
+                # Release the rejected response's connection before retrying
+                response.close()
                 # Force new token acquisition
                 self.auth_manager.token = None
                 headers = self._get_headers()
-                response = requests.request(
+                response = self.session.request(
                     method=method,
                     url=url,
                     headers=headers,
                     params=params,
                     json=data,
-                    proxies=self.proxies
+                    proxies=self.proxies,
+                    stream=stream_items
                 )
             
             if config.DEBUG:
                 config.logger.debug(f"Response status code: {response.status_code}")
                 config.logger.debug(f"Response headers: {response.headers}")
-                if response.content:
-                    # Limit response content logging to avoid excessive output
-                    content_str = response.content.decode('utf-8')
-                    if len(content_str) > 500:
-                        config.logger.debug(f"Response content (truncated): {content_str[:500]}...")
+                content = response.content
+                if content:
+                    # Limit response content logging to avoid excessive output;
+                    # only the logged prefix is decoded, the JSON parser reads the raw bytes
+                    if len(content) > 500:
+                        config.logger.debug(f"Response content (truncated): {content[:500].decode('utf-8', errors='replace')}...")
                     else:
-                        config.logger.debug(f"Response content: {content_str}")
+                        config.logger.debug(f"Response content: {content.decode('utf-8', errors='replace')}")
             
             response.raise_for_status()
-            return response.json() if response.content else None
+            
+            if stream_items:
+                content_length = int(response.headers.get('Content-Length') or 0)
+                # Unknown length (chunked transfer) or above threshold: stream the items
+                if not content_length or content_length >= config.STREAM_THRESHOLD_BYTES:
+                    config.logger.debug(f"Streaming response items from {endpoint}")
+                    streamed = True
+                    return {'value': self._stream_items(response, endpoint, method, start_time)}
+            
+            return response_json(response) if response.content else None
             
         except requests.exceptions.RequestException as e:
             status = "error"
@@ -219,12 +246,60 @@ class CitrixAPIClient:
                     config.logger.debug(f"Error response content: {e.response.content.decode('utf-8')}")
             raise e
         finally:
-            # Record duration and requests metrics
-            duration = time.time() - start_time
-            API_LATENCY.labels(endpoint=endpoint, method=method).observe(duration)
-            API_REQUESTS.labels(endpoint=endpoint, method=method, status=status).inc()
-            if config.DEBUG:
-                config.logger.debug(f"Request duration: {duration:.3f} seconds")
+            if not streamed:
+                self._record_request(endpoint, method, start_time, status)
+
+    def _record_request(self, endpoint, method, start_time, status):
+        """Record the duration and the success/error counter of a request."""
+        duration = time.time() - start_time
+        counters = get_api_counters(endpoint, method)
+        counters['timer'].observe(duration)
+        counters[status].inc()
+        if config.DEBUG:
+            config.logger.debug(f"Request duration: {duration:.3f} seconds")
+
+    def _stream_items(self, response, endpoint, method, start_time):
+        """
+        Yield the items of the 'value' array of a streamed response one at a time,
+        without materializing the whole body, then release the connection.
+        The request metrics are recorded once the body has been read, so a failure
+        while reading (connection reset, truncated or malformed JSON) counts as an error;
+        the recorded duration covers the whole read.
+        
+        Args:
+            response: A requests response obtained with stream=True
+            endpoint: API endpoint, for the request metrics
+            method: HTTP method, for the request metrics
+            start_time: time.time() at the start of the request
+        """
+        status = "success"
+        try:
+            # Let urllib3 undo any Content-Encoding (e.g. gzip) while reading
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, 'value.item', use_float=True)
+        except Exception as e:
+            status = "error"
+            config.logger.error(f"Reading streamed response from {endpoint} failed: {str(e)}")
+            raise
+        finally:
+            response.close()
+            self._record_request(endpoint, method, start_time, status)
+
+    def _store_run_when_consumed(self, items, api_name, end_time):
+        """
+        Yield the streamed items and save end_time as the last run of api_name only
+        once all of them have been read: if the read fails midway the time window
+        is not advanced and the next run collects the same interval again.
+        
+        Args:
+            items: Iterator over the streamed items
+            api_name: Name of the API
+            end_time: End of the queried time window
+        """
+        from database.postgres_client import postgres_manager
+        
+        yield from items
+        postgres_manager.store_last_endpoint_run(api_name, end_time)
 
     def get_with_pagination(self, endpoint, params=None, api_type=None):
         """
@@ -340,12 +415,14 @@ class CitrixAPIClient:
         # Ensure we always return data in the format postgres_client expects
         return {'Items': all_items}
 
-    def query_api(self, api_name, **kwargs):
+    def query_api(self, api_name, stream_items=False, **kwargs):
         """
         Funzione generica per eseguire query alle API Citrix basate sulla configurazione.
         
         Args:
             api_name: Nome dell'API da interrogare, deve corrispondere a una chiave in api_configs
+            stream_items: Se True, le risposte OData molto grandi restituiscono {'value': iteratore}
+                i cui elementi vengono letti in streaming
             **kwargs: Parametri aggiuntivi per sovrascrivere la configurazione di default
             
         Returns:
@@ -442,11 +519,16 @@ class CitrixAPIClient:
         # Se abbiamo parametri di query, esegui la richiesta con i parametri
         if query_parts:
             # Esegui la query
-            response = self._make_request('GET', endpoint, params=query_string, use_query_string=True, api_type=api_type)
+            response = self._make_request('GET', endpoint, params=query_string, use_query_string=True, api_type=api_type, stream_items=stream_items)
             
             # Se c'è un filtro temporale, salva il timestamp di fine come ultima esecuzione
             if "filter_field" in api_config:
-                postgres_manager.store_last_endpoint_run(api_name, end_time)
+                items = response.get('value') if isinstance(response, dict) else None
+                if items is not None and not isinstance(items, list):
+                    # Risposta in streaming: il timestamp viene salvato solo dopo la lettura completa
+                    response['value'] = self._store_run_when_consumed(items, api_name, end_time)
+                else:
+                    postgres_manager.store_last_endpoint_run(api_name, end_time)
             
             return response
         
@@ -569,33 +651,42 @@ class CitrixAPIClient:
             config.logger.info(f"Found {len(filtered_items)} new log entries for {api_name}")
             
             # Try to send logs to VictoriaLogs, but don't block if it fails
+            delivered = False
             try:
                 victoria_logs_manager.write_logs(
                     filtered_items,
                     log_source=f"citrix_{api_name}",
                     metric_type="citrix_logs"
                 )
+                # write_logs only buffers the entries: send them now, so the timestamp below
+                # never moves past entries that have not reached VictoriaLogs
+                delivered = victoria_logs_manager.flush()
             except Exception as e:
                 config.logger.error(f"Failed to send logs to VictoriaLogs: {str(e)}")
                 config.logger.info("Continuing with processing despite VictoriaLogs error")
             
-            # Update the last execution timestamp using the latest FormattedEndTime
-            try:
-                latest_timestamp = None
-                
-                for item in filtered_items:
-                    if "FormattedEndTime" in item:
-                        entry_timestamp = item["FormattedEndTime"]
-                        if latest_timestamp is None or entry_timestamp > latest_timestamp:
-                            latest_timestamp = entry_timestamp
-                
-                if latest_timestamp:
-                    postgres_manager.store_last_endpoint_run(api_name, latest_timestamp)
-                    config.logger.debug(f"Updated last execution timestamp for {api_name} to {latest_timestamp}")
-                else:
-                    config.logger.warning(f"No FormattedEndTime found in any log entries for {api_name}")
-            except Exception as e:
-                config.logger.error(f"Failed to update last execution timestamp: {str(e)}")
+            if not delivered:
+                # Keep the previous timestamp: the same entries are collected again on the next run
+                config.logger.warning(f"Log entries for {api_name} were not delivered to VictoriaLogs, "
+                                      f"last execution timestamp not updated")
+            else:
+                # Update the last execution timestamp using the latest FormattedEndTime
+                try:
+                    latest_timestamp = None
+                    
+                    for item in filtered_items:
+                        if "FormattedEndTime" in item:
+                            entry_timestamp = item["FormattedEndTime"]
+                            if latest_timestamp is None or entry_timestamp > latest_timestamp:
+                                latest_timestamp = entry_timestamp
+                    
+                    if latest_timestamp:
+                        postgres_manager.store_last_endpoint_run(api_name, latest_timestamp)
+                        config.logger.debug(f"Updated last execution timestamp for {api_name} to {latest_timestamp}")
+                    else:
+                        config.logger.warning(f"No FormattedEndTime found in any log entries for {api_name}")
+                except Exception as e:
+                    config.logger.error(f"Failed to update last execution timestamp: {str(e)}")
         else:
             config.logger.info(f"No new log entries for {api_name}")
         
@@ -30,6 +30,45 @@ class VictoriaMetricsManager:
             config.logger.error(f"Failed to connect to VictoriaMetrics: {str(e)}")
             raise
 
+    def _build_point(self, measurement, tags, fields, timestamp=None):
+        """
+        Build an InfluxDB Point from measurement, tags, fields and optional timestamp.
+        
+        Args:
+            measurement: The measurement name
+            tags: Dictionary of tags
+            fields: Dictionary of fields (metrics values)
+            timestamp: Timestamp for the data point (defaults to now)
+        
+        Returns:
+            Point: the line protocol point
+        """
+        point = Point(measurement)
+        
+        # Add tags
+        for tag_key, tag_value in tags.items():
+            if tag_value is not None:
+                point = point.tag(tag_key, str(tag_value))
+        
+        # Add fields
+        for field_key, field_value in fields.items():
+            if field_value is not None:
+                # Ensure field value is a number or string
+                if isinstance(field_value, (int, float)):
+                    point = point.field(field_key, field_value)
+                else:
+                    try:
+                        numeric_value = float(field_value)
+                        point = point.field(field_key, numeric_value)
+                    except (ValueError, TypeError):
+                        point = point.field(field_key, str(field_value))
+        
+        # Add timestamp if provided
+        if timestamp:
+            point = point.time(timestamp)
+        
+        return point
+
     def write_metrics(self, measurement, tags, fields, timestamp=None):
         """
         Write metrics to VictoriaMetrics using InfluxDB line protocol.
@@ -41,29 +80,7 @@ class VictoriaMetricsManager:
             timestamp: Timestamp for the data point (defaults to now)
         """
         try:
-            point = Point(measurement)
-            
-            # Add tags
-            for tag_key, tag_value in tags.items():
-                if tag_value is not None:
-                    point = point.tag(tag_key, str(tag_value))
-            
-            # Add fields
-            for field_key, field_value in fields.items():
-                if field_value is not None:
-                    # Ensure field value is a number or string
-                    if isinstance(field_value, (int, float)):
-                        point = point.field(field_key, field_value)
-                    else:
-                        try:
-                            numeric_value = float(field_value)
-                            point = point.field(field_key, numeric_value)
-                        except (ValueError, TypeError):
-                            point = point.field(field_key, str(field_value))
-            
-            # Add timestamp if provided
-            if timestamp:
-                point = point.time(timestamp)
+            point = self._build_point(measurement, tags, fields, timestamp)
             
             # Write using dummy bucket/org required by InfluxDB client
             self.write_api.write(bucket=self.dummy_bucket, record=point, org=self.dummy_org)
@@ -72,6 +89,27 @@ class VictoriaMetricsManager:
             config.logger.error(f"Failed to write metrics to VictoriaMetrics: {str(e)}")
             raise
     
+    def write_metrics_batch(self, batch):
+        """
+        Write several metrics to VictoriaMetrics in a single line protocol request.
+        
+        Args:
+            batch: List of (measurement, tags, fields, timestamp) tuples
+        """
+        if not batch:
+            return
+        
+        try:
+            points = [self._build_point(measurement, tags, fields, timestamp)
+                      for measurement, tags, fields, timestamp in batch]
+            
+            # A list of points is serialized into one newline separated body
+            self.write_api.write(bucket=self.dummy_bucket, record=points, org=self.dummy_org)
+            
+        except Exception as e:
+            config.logger.error(f"Failed to write metrics batch to VictoriaMetrics: {str(e)}")
+            raise
+    
     def store_last_metrics_run(self, timestamp_iso):
         """
         Store the timestamp of the last successful metrics collection.
@@ -80,6 +118,7 @@ class VictoriaMetricsManager:
             timestamp_iso: ISO formatted timestamp string
         """
         try:
+            config.ensure_data_dir()
             with open(config.LAST_METRICS_RUN_FILE, 'w') as f:
                 f.write(timestamp_iso)
             config.logger.debug(f"Stored last metrics run timestamp: {timestamp_iso}")
@@ -2,11 +2,21 @@ import psycopg2
 import json
 import re
 import os
-import yaml
+import functools
+import threading
+import queue
 from datetime import datetime
 
 from utils import config
 
+def _synchronized(func):
+    """Serialize access to the shared connection/cursor across collector threads."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
 class PostgresManager:
     def __init__(self):
         self.host = config.POSTGRES_HOST
@@ -16,6 +26,12 @@ class PostgresManager:
         self.password = config.POSTGRES_PASSWORD
         self.conn = None
         self.cursor = None
+        # The cursor is shared, so statements from different threads must not interleave
+        self._lock = threading.RLock()
+        # Token da salvare in background (vedi store_auth_token_async)
+        self._token_queue = queue.Queue(maxsize=16)
+        self._token_writer = threading.Thread(target=self._token_writer_loop, name="token-writer", daemon=True)
+        self._token_writer.start()
         
         # Load field type definitions
         self.field_type_definitions = self._load_field_type_definitions()
@@ -602,7 +618,7 @@ class PostgresManager:
             
             if os.path.exists(field_types_file):
                 with open(field_types_file, 'r') as f:
-                    field_types = yaml.safe_load(f)
+                    field_types = config.yaml_load(f)
                     config.logger.info("Field type definitions loaded from configuration file")
                     return field_types
             else:
@@ -660,6 +676,7 @@ class PostgresManager:
         # we'll just return the lowercase version
         return normalized
     
+    @_synchronized
     def store_auth_token(self, token, expiry_time):
         """
         Salva il bearer token nel database.
@@ -669,11 +686,9 @@ class PostgresManager:
             expiry_time: Data e ora di scadenza del token
         """
         try:
-            # Prima elimina tutti i token precedenti
-            self.cursor.execute("DELETE FROM citrix_auth_tokens")
-            
-            # Poi inserisci il nuovo token
+            # Elimina i token precedenti e inserisce il nuovo in un'unica istruzione (un solo round-trip)
             self.cursor.execute("""
+            WITH deleted AS (DELETE FROM citrix_auth_tokens)
             INSERT INTO citrix_auth_tokens (token, expiry_time)
             VALUES (%s, %s)
             """, (
@@ -686,20 +701,51 @@ class PostgresManager:
             config.logger.error(f"Errore nel salvataggio del token nel database: {str(e)}")
             # Non lanciare l'eccezione per evitare blocchi nell'autenticazione
     
-    def get_auth_token(self):
+    def store_auth_token_async(self, token, expiry_time):
+        """
+        Accoda il bearer token per il salvataggio nel database da parte del thread di scrittura,
+        senza attendere il round-trip verso PostgreSQL. Se la coda è piena il token viene
+        salvato in modo sincrono.
+        
+        Args:
+            token: Il bearer token
+            expiry_time: Data e ora di scadenza del token
+        """
+        try:
+            self._token_queue.put_nowait((token, expiry_time))
+        except queue.Full:
+            self.store_auth_token(token, expiry_time)
+    
+    def _token_writer_loop(self):
+        """Salva i token accodati; se ne sono in coda più di uno, salva solo il più recente."""
+        while True:
+            item = self._token_queue.get()
+            try:
+                while True:
+                    item = self._token_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.store_auth_token(*item)
+    
+    @_synchronized
+    def get_auth_token(self, min_ttl_seconds=0):
         """
         Recupera il token più recente dal database se non è scaduto.
         
+        Args:
+            min_ttl_seconds: Validità residua minima richiesta, in secondi; i token
+                che scadono prima vengono ignorati già nella query
+        
         Returns:
             Tuple (token, expiry_time) o (None, None) se non trovato o scaduto
         """
         try:
             self.cursor.execute("""
             SELECT token, expiry_time FROM citrix_auth_tokens
-            WHERE expiry_time > NOW()
+            WHERE expiry_time > NOW() + make_interval(secs => %s)
             ORDER BY created_at DESC
             LIMIT 1
-            """)
+            """, (min_ttl_seconds,))
             
             result = self.cursor.fetchone()
             if result:
@@ -713,6 +759,7 @@ class PostgresManager:
             config.logger.error(f"Errore nel recupero del token dal database: {str(e)}")
             return None, None
     
+    @_synchronized
     def store_last_endpoint_run(self, endpoint, timestamp):
         """
         Memorizza il timestamp dell'ultima esecuzione di una specifica query endpoint.
@@ -750,6 +797,7 @@ class PostgresManager:
         except Exception as e:
             config.logger.error(f"Error storing last run timestamp for endpoint {endpoint}: {str(e)}")
     
+    @_synchronized
     def get_last_endpoint_run(self, endpoint):
         """
         Recupera il timestamp dell'ultima esecuzione di una specifica query endpoint.
@@ -778,6 +826,7 @@ class PostgresManager:
             config.logger.error(f"Error retrieving last run for endpoint {endpoint}: {str(e)}")
             return None
     
+    @_synchronized
     def store_site_id(self, site_id):
         """Store Citrix site ID in the database and cache."""
         try:
@@ -810,6 +859,7 @@ class PostgresManager:
             config.logger.error(f"Failed to store Citrix site ID: {str(e)}")
             return False
     
+    @_synchronized
     def get_site_id(self):
         """Retrieve Citrix site ID from cache or database."""
         try:
@@ -860,6 +910,7 @@ class PostgresManager:
                 config.logger.debug(f"Detailed error traceback: {traceback.format_exc()}")
             return False
     
+    @_synchronized
     def store_entity(self, entity_type, data, api_callback=None):
         """
         Generic method to store any entity type in the database based on configuration.
@@ -3,11 +3,90 @@ Module for sending log data to VictoriaLogs
 """
 import requests
 import json
+import threading
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any
 
 from utils import config
 
+# Lookup table for the IsSuccessful flag, avoids calling str() on every entry
+_IS_SUCCESS = {True: "True", False: "False", None: "", "": ""}
+
+def _is_successful(value):
+    """Return the string form of IsSuccessful, falling back to str() for unexpected values."""
+    try:
+        return _IS_SUCCESS[value]
+    except (KeyError, TypeError):
+        return str(value)
+
+class LogBatcher:
+    """
+    Buffers serialized log entries and flushes them as a single payload once
+    max_entries is reached or flush_interval seconds have passed since the
+    first buffered entry. send returns False when a batch could not be delivered;
+    flush() reports whether every batch since the previous flush() was delivered.
+    """
+    def __init__(self, send: Callable[[List[bytes]], bool], max_entries: int = 500, flush_interval: float = 0.1):
+        self._send = send
+        self._max_entries = max_entries
+        self._flush_interval = flush_interval
+        self._buf: List[bytes] = []
+        self._lock = threading.Lock()
+        self._timer = None
+        # Set when a batch fails to send, cleared by flush()
+        self._failed = False
+    
+    def add(self, entry_bytes: bytes):
+        """Add a serialized entry to the buffer, flushing if the buffer is full."""
+        with self._lock:
+            self._buf.append(entry_bytes)
+            if len(self._buf) >= self._max_entries:
+                batch = self._swap()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self._flush_interval, self._send_pending)
+                    self._timer.daemon = True
+                    self._timer.start()
+        
+        if batch:
+            self._send_batch(batch)
+    
+    def flush(self) -> bool:
+        """
+        Send whatever is currently buffered.
+        
+        Returns:
+            bool: True if every batch sent since the previous flush() was delivered
+        """
+        self._send_pending()
+        with self._lock:
+            delivered = not self._failed
+            self._failed = False
+        return delivered
+    
+    def _send_pending(self):
+        """Send the buffered entries, if any (also run by the flush timer)."""
+        with self._lock:
+            batch = self._swap()
+        
+        if batch:
+            self._send_batch(batch)
+    
+    def _send_batch(self, batch: List[bytes]):
+        """Send a batch, remembering a failed delivery for the next flush()."""
+        if not self._send(batch):
+            with self._lock:
+                self._failed = True
+    
+    def _swap(self) -> List[bytes]:
+        """Take the current buffer and cancel the pending timer. Caller must hold the lock."""
+        batch, self._buf = self._buf, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
 class VictoriaLogsManager:
     """Manager for sending logs to VictoriaLogs"""
     def __init__(self):
@@ -23,16 +102,23 @@ class VictoriaLogsManager:
             config.logger.info(f"URL contains query parameters, using base URL: {base_url}")
             self.url = base_url
         
-        # Default parameters (specified in requirements)
-        self.default_params = {
-            "_msg_field": "fields.Text", 
+        # Parameters actually sent with each NDJSON request
+        self.params = {
+            "_msg_field": "fields.Text",
             "_time_field": "timestamp",
-            "_stream_fields": "tags.log_source,tags.metric_type"
+            "_stream_fields": "stream"
         }
         
+        # Coalesce small write_logs calls into fewer, larger POSTs
+        self._batcher = LogBatcher(
+            self._send,
+            max_entries=config.VICTORIA_LOGS_BATCH_SIZE,
+            flush_interval=config.VICTORIA_LOGS_FLUSH_INTERVAL
+        )
+        
         # Log initialization info
         config.logger.debug(f"VictoriaLogs endpoint: {self.url}")
-        config.logger.debug(f"Default parameters: {self.default_params}")
+        config.logger.debug(f"Parameters: {self.params}")
         
         config.logger.info(f"VictoriaLogsManager initialized with URL: {self.url}")
     
@@ -52,7 +138,6 @@ class VictoriaLogsManager:
         try:
             # Prepara un array di entry JSON da inviare come NDJSON
             formatted_entries = []
-            stream_fields = []
             
             for entry in log_data:
                 # Get timestamp from FormattedEndTime or current time
@@ -68,7 +153,7 @@ class VictoriaLogsManager:
                     "User": entry.get("User", ""),
                     "Source": entry.get("Source", ""),
                     "AdminMachineIP": entry.get("AdminMachineIP", ""),
-                    "IsSuccessful": str(entry.get("IsSuccessful", "")),
+                    "IsSuccessful": _is_successful(entry.get("IsSuccessful", "")),
                     "OperationType": entry.get("OperationType", ""),
                     "fields": {
                         # Text is the field to be used as message
@@ -90,35 +175,55 @@ class VictoriaLogsManager:
                 #         log_entry["fields"][key] = value
                 
                 # Convert the entry to JSON and add to our array
-                formatted_entries.append(json.dumps(log_entry))
-                
-                # Add tag fields for stream parameters
-                # if not stream_fields and log_entry["tags"]:
-                #     stream_fields = list(log_entry["tags"].keys())
+                formatted_entries.append(json.dumps(log_entry).encode('utf-8'))
             
-            # Join all entries with newlines to create NDJSON
-            ndjson_payload = "\n".join(formatted_entries)
+            # Hand the serialized entries to the batcher, which coalesces them
+            # with other small writes into a single NDJSON POST
+            for formatted_entry in formatted_entries:
+                self._batcher.add(formatted_entry)
             
-            # Construct the full stream fields parameter
-            stream_fields_param = "tags." + ",tags.".join(stream_fields)
+            if config.DEBUG:
+                config.logger.debug(f"Queued {len(formatted_entries)} log entries for VictoriaLogs")
+                if formatted_entries:
+                    config.logger.debug(f"First entry sample: {formatted_entries[0][:200]}...")
             
-            # Construct URL parameters
-            params = {
-                "_msg_field": "fields.Text",
-                "_time_field": "timestamp",
-                "_stream_fields": "stream"
-            }
+        except Exception as e:
+            config.logger.error(f"Error queueing logs for VictoriaLogs: {str(e)}")
+            if config.DEBUG:
+                import traceback
+                config.logger.debug(f"Error traceback: {traceback.format_exc()}")
+    
+    def flush(self) -> bool:
+        """
+        Send any buffered log entries to VictoriaLogs immediately.
+        
+        Returns:
+            bool: True if all the entries written since the previous flush were delivered
+        """
+        return self._batcher.flush()
+    
+    def _send(self, formatted_entries: List[bytes]) -> bool:
+        """
+        Send a batch of serialized log entries to VictoriaLogs as one NDJSON payload
+        
+        Args:
+            formatted_entries: List of JSON-encoded log entries
+        
+        Returns:
+            bool: True if VictoriaLogs accepted the batch
+        """
+        try:
+            # Join all entries with newlines to create NDJSON
+            ndjson_payload = b"\n".join(formatted_entries)
             
             if config.DEBUG:
-                config.logger.debug(f"Using parameters for VictoriaLogs: {params}")
+                config.logger.debug(f"Using parameters for VictoriaLogs: {self.params}")
                 config.logger.debug(f"NDJSON payload size: {len(ndjson_payload)} bytes, {len(formatted_entries)} entries")
-                if formatted_entries:
-                    config.logger.debug(f"First entry sample: {formatted_entries[0][:200]}...")
             
             # Send NDJSON payload to VictoriaLogs in a single request
             response = requests.post(
                 self.url,
-                params=params,
+                params=self.params,
                 data=ndjson_payload,
                 headers={"Content-Type": "application/stream+json"},
                 proxies=None  # Ensure no proxy is used
@@ -133,6 +238,7 @@ class VictoriaLogsManager:
                     config.logger.debug(f"VictoriaLogs response content: {response.text[:500]}")
             
             config.logger.info(f"Successfully sent {len(formatted_entries)} log entries to VictoriaLogs in a single request")
+            return True
             
         except Exception as e:
             config.logger.error(f"Error sending logs to VictoriaLogs: {str(e)}")
@@ -144,6 +250,7 @@ class VictoriaLogsManager:
                         config.logger.debug(f"Response status code: {response.status_code}")
                     if hasattr(response, 'text'):
                         config.logger.debug(f"Response content: {response.text[:500]}")
+            return False
 
 # Create a singleton instance
 victoria_logs_manager = VictoriaLogsManager()
@@ -1,14 +1,15 @@
 import time
-import schedule
+import sched
 import threading
-from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 import signal
 import sys
 import http.server
-import socketserver
-import json
+import itertools
+import operator
 import os
-import yaml
 from prometheus_client import start_http_server, generate_latest, CONTENT_TYPE_LATEST
 
 from utils import config
@@ -16,23 +17,161 @@ from api.citrix_client import citrix_client
 from database.influx_client import victoria_metrics_manager
 from database.postgres_client import postgres_manager
 from database.victorialogs_client import victoria_logs_manager
-from database.victorialogs_client import victoria_logs_manager
 from utils.prometheus_metrics import (
     initialize_metrics, METRICS_COLLECTION_DURATION, METRICS_COLLECTION_ERRORS,
     API_REQUESTS, API_LATENCY, APP_INFO
 )
 
+# orjson serializes directly to bytes and is much faster than the stdlib json module
+try:
+    import orjson
+    
+    def _dumps_bytes(obj):
+        return orjson.dumps(obj, default=list)
+except ImportError:
+    import json
+    
+    def _dumps_bytes(obj):
+        return json.dumps(obj, default=list).encode()
+
+def _dumps(obj):
+    """Serialize obj to a JSON string (used for DEBUG logging)."""
+    return _dumps_bytes(obj).decode()
+
 # Global variable to track application health
 app_health = {
     "status": "starting",
     "last_metrics_run": None,
     "last_config_run": None,
-    "errors": []
+    "errors": deque(maxlen=10)
 }
 
+# Serialized app_health, rebuilt only when app_health changes so /health just writes bytes
+_health_lock = threading.Lock()
+_health_bytes = _dumps_bytes(app_health)
+
+def _set_health(**updates):
+    """Update app_health fields and refresh its serialized form."""
+    global _health_bytes
+    with _health_lock:
+        app_health.update(updates)
+        _health_bytes = _dumps_bytes(app_health)
+
+def _add_health_error(component, message):
+    """Record an error in app_health (the deque keeps only the last 10) and refresh its serialized form."""
+    global _health_bytes
+    with _health_lock:
+        app_health["errors"].append({
+            "time": datetime.now().isoformat(),
+            "component": component,
+            "message": message
+        })
+        _health_bytes = _dumps_bytes(app_health)
+
+# Debug flag bound once at import, avoids a module attribute lookup on every check
+_DEBUG = config.DEBUG
+
+# Scheduler delle raccolte periodiche, basato su tempo monotono
+scheduler = sched.scheduler(time.monotonic, time.sleep)
+
 # Flag per indicare se le metriche Prometheus sono abilitate
 ENABLE_PROMETHEUS_METRICS = os.environ.get('ENABLE_PROMETHEUS_METRICS', 'true').lower() == 'true'
 
+# Numero massimo di API interrogate in parallelo durante una raccolta
+COLLECTION_MAX_WORKERS = int(os.environ.get('COLLECTION_MAX_WORKERS', '8'))
+
+# Numero di punti scritti per richiesta quando gli item di una risposta arrivano in streaming
+STREAM_WRITE_CHUNK_SIZE = int(os.environ.get('STREAM_WRITE_CHUNK_SIZE', '5000'))
+
+# Parser C per i timestamp ISO 8601, con fallback sulla libreria standard
+try:
+    from ciso8601 import parse_datetime
+except ImportError:
+    parse_datetime = datetime.fromisoformat
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Cache of generated extract functions, keyed by their generated source: it depends only on
+# the tag and field mappings, so reloading config.yaml with unchanged mappings reuses the same
+# function and no reference to the old query configurations is kept
+_extractors_cache = {}
+
+def _mapping_source(target, name, path):
+    """
+    Genera il codice che legge un valore da item secondo un percorso di mappatura
+    (chiave diretta o lista di chiavi nidificate) e lo assegna a target[name] se non è None.
+    """
+    if isinstance(path, str):
+        lines = [f"v = item.get({path!r})"]
+    elif isinstance(path, list) and path:
+        lines = [f"v = item.get({path[0]!r})"]
+        lines += [f"v = v.get({key!r}) if isinstance(v, dict) else None" for key in path[1:]]
+    else:
+        # Tipo di mappatura non supportato: non estrae mai nulla
+        return []
+    lines.append(f"if v is not None: {target}[{name!r}] = v")
+    return lines
+
+def _extract_source(query_config):
+    """
+    Genera, a partire da tag_mappings e field_mappings, il sorgente di una funzione dedicata alla query
+    che estrae tag e campi da un item con accessi diretti, senza interpretare la mappatura per ogni item.
+    
+    Returns:
+        str: Sorgente della funzione extract(item) -> (tags, fields)
+    """
+    body = ["tags = {}", "fields = {}"]
+    for name, path in query_config['tag_mappings'].items():
+        body += _mapping_source('tags', name, path)
+    for name, path in query_config['field_mappings'].items():
+        body += _mapping_source('fields', name, path)
+    body.append("return tags, fields")
+    
+    return "def extract(item):\n" + "\n".join("    " + line for line in body)
+
+def _compile_extract(source):
+    """
+    Compila il sorgente generato da _extract_source.
+    
+    Returns:
+        function: extract(item) -> (tags, fields)
+    """
+    namespace = {}
+    exec(source, namespace)
+    return namespace['extract']
+
+def _timestamp_ns(value):
+    """
+    Converte un timestamp ISO 8601 restituito dalle API Citrix in nanosecondi epoch,
+    il formato nativo del line protocol, così il client InfluxDB non deve riparsarlo.
+    I timestamp senza fuso orario sono considerati UTC, come fa il client InfluxDB.
+    Valori non stringa o non interpretabili vengono restituiti invariati.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        dt = parse_datetime(value)
+    except ValueError:
+        return value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+def _get_extractor(query_config):
+    """
+    Restituisce la funzione di estrazione generata per una query, compilandola solo
+    la prima volta che si incontrano le sue mappature.
+    
+    Returns:
+        function: extract(item) -> (tags, fields)
+    """
+    source = _extract_source(query_config)
+    extract = _extractors_cache.get(source)
+    if extract is None:
+        extract = _extractors_cache[source] = _compile_extract(source)
+    return extract
+
 # This function has been moved to utils/config.py
 # We're keeping this reference for backward compatibility, but it now just forwards to the centralized function
 def load_api_config():
@@ -56,294 +195,269 @@ def load_queries_config():
     # Use centralized function with caching to avoid loading the file multiple times
     return config.load_queries_config()
 
-def collect_metrics(api_name=None):
+def _collect_one_metric(query_config, api_configs):
     """
-    Colleziona metriche da Citrix Cloud e le memorizza in VictoriaMetrics.
+    Esegue la query di una singola API metrica e scrive i punti su VictoriaMetrics.
     
     Args:
-        api_name: Se specificato, raccoglie solo le metriche per quell'API specifica
+        query_config: Configurazione della query metrica
+        api_configs: Configurazioni delle API
     """
-    if api_name:
-        config.logger.info(f"Starting metrics collection for {api_name}")
-    else:
-        config.logger.info("Starting metrics collection for all configured APIs")
+    current_api_name = query_config['api_name']
+    measurement_name = query_config['measurement_name']
+    
+    # Ottieni il campo timestamp dalla configurazione API se disponibile
+    timestamp_field = None
+    if current_api_name in api_configs and 'timestamp_field' in api_configs[current_api_name]:
+        timestamp_field = api_configs[current_api_name]['timestamp_field']
+        if _DEBUG:
+            config.logger.debug(f"Will use '{timestamp_field}' as timestamp field for {current_api_name}")
+    
+    config.logger.info(f"Collecting {current_api_name} metrics")
+    if _DEBUG:
+        config.logger.debug(f"Using configuration: {_dumps(query_config)}")
+        # Check if we're dealing with a log type API
+        if current_api_name in api_configs and api_configs[current_api_name].get('type') == 'log':
+            config.logger.debug(f"API {current_api_name} is of type 'log', will be handled by _handle_log_api")
+    
+    # Esegui la query all'API
+    config.logger.debug("Calling query_api for %s", current_api_name)
+    response = citrix_client.query_api(current_api_name, stream_items=True)
+    
+    if not response:
+        if _DEBUG:
+            config.logger.debug(f"No {current_api_name} metrics received or empty response")
+        return
     
-    global app_health
+    # Estrai gli elementi dalla risposta
+    items = []
+    if isinstance(response, dict) and 'value' in response:
+        items = response['value']
+    elif isinstance(response, list):
+        items = response
     
-    # Track metrics collection duration
-    start_time = time.time()
+    if _DEBUG and isinstance(items, list):
+        config.logger.debug(f"Received {len(items)} items from {current_api_name} API")
     
-    try:
-        # Carica la configurazione delle query e delle API
-        queries_config = load_queries_config()
-        api_configs = load_api_config()
-        
-        # Se non è stata trovata nessuna configurazione, esci
-        if queries_config is None:
-            config.logger.error("No queries configuration available, skipping metrics collection")
-            return
+    extract = _get_extractor(query_config)
+    
+    if _DEBUG and isinstance(items, list) and items:
+        # Logga solo i primi 3 item come esempi, serializzati con una sola chiamata
+        config.logger.debug(f"Sample {current_api_name} items: {_dumps(items[:3])}")
+    
+    # Getter del campo timestamp, risolto una sola volta per API
+    ts_getter = operator.itemgetter(timestamp_field) if timestamp_field else None
+    
+    if isinstance(items, list):
+        chunks = (items,)
+    else:
+        # Risposta in streaming: scrivi i punti a blocchi man mano che vengono letti
+        chunks = _chunked(items, STREAM_WRITE_CHUNK_SIZE)
+    
+    stored = 0
+    for chunk in chunks:
+        # Accumula i punti del blocco e scrivili con una singola richiesta
+        batch = [None] * len(chunk)
+        for idx, item in enumerate(chunk):
+            # Estrai tag e campi con la funzione generata per questa query
+            tags, fields = extract(item)
             
-        # Current time as end time
-        now = datetime.now().isoformat()
-        
-        if config.DEBUG:
-            config.logger.debug(f"Current run time: {now}")
-        
-        # Esegui tutte le query metriche configurate o solo quella specificata
-        if 'metrics' in queries_config:
-            for query_config in queries_config['metrics']:
-                current_api_name = query_config['api_name']
-                
-                # Se è stato specificato un api_name e non corrisponde a quello corrente, salta
-                if api_name and current_api_name != api_name:
-                    continue
-                    
-                measurement_name = query_config['measurement_name']
-                
-                # Ottieni il campo timestamp dalla configurazione API se disponibile
-                timestamp_field = None
-                if current_api_name in api_configs and 'timestamp_field' in api_configs[current_api_name]:
-                    timestamp_field = api_configs[current_api_name]['timestamp_field']
-                    if config.DEBUG:
-                        config.logger.debug(f"Will use '{timestamp_field}' as timestamp field for {current_api_name}")
-                
-                config.logger.info(f"Collecting {current_api_name} metrics")
-                if config.DEBUG:
-                    config.logger.debug(f"Using configuration: {json.dumps(query_config)}")
-                    # Check if we're dealing with a log type API
-                    if current_api_name in api_configs and api_configs[current_api_name].get('type') == 'log':
-                        config.logger.debug(f"API {current_api_name} is of type 'log', will be handled by _handle_log_api")
-                
+            # Ottieni il timestamp se configurato
+            timestamp = None
+            if ts_getter:
                 try:
-                    # Esegui la query all'API
-                    config.logger.debug(f"Calling query_api for {current_api_name}")
-                    response = citrix_client.query_api(current_api_name)
-                    
-                    if response:
-                        # Estrai gli elementi dalla risposta
-                        items = []
-                        if isinstance(response, dict) and 'value' in response:
-                            items = response['value']
-                        elif isinstance(response, list):
-                            items = response
-                        
-                        if config.DEBUG:
-                            config.logger.debug(f"Received {len(items)} items from {current_api_name} API")
-                        
-                        for idx, item in enumerate(items):
-                            if config.DEBUG and idx < 3:  # Logga solo i primi 3 item come esempi
-                                config.logger.debug(f"Sample {current_api_name} item {idx+1}: {json.dumps(item)}")
-                            
-                            # Estrai i tag in base alla mappatura configurata
-                            tags = {}
-                            for tag_name, item_key in query_config['tag_mappings'].items():
-                                if isinstance(item_key, list):  # Path nidificato
-                                    value = item
-                                    for key in item_key:
-                                        if isinstance(value, dict) and key in value:
-                                            value = value[key]
-                                        else:
-                                            value = None
-                                            break
-                                    if value is not None:
-                                        tags[tag_name] = value
-                                elif isinstance(item_key, str) and item_key in item:  # Chiave diretta
-                                    tags[tag_name] = item[item_key]
-                            
-                            # Estrai i campi in base alla mappatura configurata
-                            fields = {}
-                            for field_name, item_key in query_config['field_mappings'].items():
-                                if isinstance(item_key, list):  # Path nidificato
-                                    value = item
-                                    for key in item_key:
-                                        if isinstance(value, dict) and key in value:
-                                            value = value[key]
-                                        else:
-                                            value = None
-                                            break
-                                    if value is not None:
-                                        fields[field_name] = value
-                                elif isinstance(item_key, str) and item_key in item:  # Chiave diretta
-                                    fields[field_name] = item[item_key]
-                            
-                            # Ottieni il timestamp se configurato
-                            timestamp = None
-                            if timestamp_field and timestamp_field in item:
-                                timestamp = item[timestamp_field]
-                                if config.DEBUG and idx < 3:
-                                    config.logger.debug(f"Using timestamp '{timestamp}' from field '{timestamp_field}' for item {idx+1}")
-                            
-                            # Scrivi su VictoriaMetrics
-                            victoria_metrics_manager.write_metrics(measurement_name, tags, fields, timestamp)
-                        
-                        config.logger.info(f"Stored {len(items)} {current_api_name} metrics points")
-                    else:
-                        if config.DEBUG:
-                            config.logger.debug(f"No {current_api_name} metrics received or empty response")
-                
-                except Exception as e:
-                    error_msg = f"Error during {current_api_name} metrics collection: {str(e)}"
-                    config.logger.error(error_msg)
-                    
-                    if config.DEBUG:
-                        import traceback
-                        config.logger.debug(f"Detailed error traceback: {traceback.format_exc()}")
-                        
-                    # Increment error counter
-                    if ENABLE_PROMETHEUS_METRICS:
-                        METRICS_COLLECTION_ERRORS.labels(type=f'metrics_{current_api_name}').inc()
-        
-        # Store the current time as the last successful run
-        victoria_metrics_manager.store_last_metrics_run(now)
-        if config.DEBUG:
-            config.logger.debug(f"Updated last metrics run timestamp to {now}")
+                    timestamp = _timestamp_ns(ts_getter(item))
+                except KeyError:
+                    timestamp = None
+                if _DEBUG and idx < 3 and timestamp is not None:
+                    config.logger.debug(f"Using timestamp '{timestamp}' from field '{timestamp_field}' for item {idx+1}")
+            
+            batch[idx] = (measurement_name, tags, fields, timestamp)
         
-        # Update health status
-        app_health["status"] = "healthy"
-        app_health["last_metrics_run"] = now
+        # Scrivi su VictoriaMetrics
+        victoria_metrics_manager.write_metrics_batch(batch)
+        stored += len(batch)
+    
+    config.logger.info(f"Stored {stored} {current_api_name} metrics points")
+
+def _chunked(iterable, size):
+    """Yield successive lists of at most size elements from iterable."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+# Nome leggibile di ogni tipo di raccolta, usato nei messaggi di log
+_COLLECTION_LABELS = {'metrics': 'metrics', 'config': 'configuration'}
+
+def _collect_one_configuration(query_config, api_configs=None):
+    """
+    Esegue la query di una singola API di configurazione e salva i dati in PostgreSQL.
+    
+    Args:
+        query_config: Configurazione della query di configurazione
+        api_configs: Non utilizzato, presente per uniformità con _collect_one_metric
+    """
+    current_api_name = query_config['api_name']
+    
+    # Se è specificato un override del nome API, usa quello per la query
+    api_query_name = query_config.get('api_name_override', current_api_name)
+    entity_type = api_query_name.replace('_config', '')  # Remove _config suffix if present
+    
+    config.logger.info(f"Collecting {current_api_name} configuration")
+    if _DEBUG:
+        config.logger.debug(f"Using configuration: {_dumps(query_config)}")
+    
+    # Esegui la query all'API senza passare il site_id
+    response = citrix_client.query_api(api_query_name)
+    
+    if response:
+        if _DEBUG:
+            config.logger.debug(f"Received {len(response) if isinstance(response, list) else 'object'} from {current_api_name} API")
         
-    except Exception as e:
-        error_msg = f"Error during metrics collection: {str(e)}"
+        # Store configuration data using the generic store_entity method
+        postgres_manager.store_entity(entity_type, response)
+        config.logger.info(f"Stored {current_api_name} configuration data")
+    else:
+        if _DEBUG:
+            config.logger.debug(f"No {current_api_name} configuration received or empty response")
+
+def _run_collectors(collector, query_configs, api_configs, kind):
+    """
+    Esegue il collector per ogni query, in parallelo quando ce n'è più di una.
+    Gli errori di una singola API vengono loggati e conteggiati senza interrompere le altre.
+    
+    Args:
+        collector: Funzione che raccoglie i dati per una singola query
+        query_configs: Lista delle configurazioni delle query da eseguire
+        api_configs: Configurazioni delle API passate al collector
+        kind: 'metrics' o 'config', usato per messaggi di errore e label Prometheus
+    """
+    label = _COLLECTION_LABELS[kind]
+    
+    def handle_error(query_config, e):
+        current_api_name = query_config['api_name']
+        error_msg = f"Error during {current_api_name} {label} collection: {str(e)}"
         config.logger.error(error_msg)
-        if config.DEBUG:
-            import traceback
-            config.logger.debug(f"Detailed error traceback: {traceback.format_exc()}")
-            
-        app_health["errors"].append({
-            "time": datetime.now().isoformat(),
-            "component": "metrics_collector",
-            "message": error_msg
-        })
-        # Keep only the last 10 errors
-        if len(app_health["errors"]) > 10:
-            app_health["errors"] = app_health["errors"][-10:]
         
+        if _DEBUG:
+            config.logger.debug("Detailed error traceback:", exc_info=e)
+            
         # Increment error counter
         if ENABLE_PROMETHEUS_METRICS:
-            METRICS_COLLECTION_ERRORS.labels(type='metrics').inc()
-    
-    finally:
-        # Record collection duration
-        duration = time.time() - start_time
-        if ENABLE_PROMETHEUS_METRICS:
-            collector_type = f'metrics_{api_name}' if api_name else 'metrics'
-            METRICS_COLLECTION_DURATION.labels(type=collector_type).observe(duration)
-            
-        if config.DEBUG:
-            config.logger.debug(f"Metrics collection completed in {duration:.2f} seconds")
+            METRICS_COLLECTION_ERRORS.labels(type=f'{kind}_{current_api_name}').inc()
+    
+    # Una sola query: eseguila direttamente senza creare un pool di thread
+    if len(query_configs) <= 1:
+        for query_config in query_configs:
+            try:
+                collector(query_config, api_configs)
+            except Exception as e:
+                handle_error(query_config, e)
+        return
     
-    config.logger.info("Metrics collection completed")
+    # Le chiamate alle API sono I/O-bound: sovrapponi le attese su endpoint indipendenti
+    with ThreadPoolExecutor(max_workers=min(COLLECTION_MAX_WORKERS, len(query_configs))) as executor:
+        futures = {executor.submit(collector, q, api_configs): q for q in query_configs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                handle_error(futures[future], e)
 
-def collect_configurations(api_name=None):
+def _run_collection(kind, collector, api_name=None, on_success=None):
     """
-    Colleziona dati di configurazione da Citrix Cloud e li memorizza in PostgreSQL.
+    Scheletro comune delle raccolte: carica le configurazioni, esegue il collector
+    per le query della sezione kind, aggiorna lo stato di salute e le metriche Prometheus.
     
     Args:
-        api_name: Se specificato, raccoglie solo la configurazione per quell'API specifica
+        kind: 'metrics' o 'config', sezione di queries_config da eseguire
+        collector: Funzione che raccoglie i dati per una singola query
+        api_name: Se specificato, esegue solo la query per quell'API specifica
+        on_success: Funzione opzionale chiamata con il timestamp della raccolta al termine
     """
+    label = _COLLECTION_LABELS[kind]
     if api_name:
-        config.logger.info(f"Starting configuration collection for {api_name}")
+        config.logger.info(f"Starting {label} collection for {api_name}")
     else:
-        config.logger.info("Starting configuration collection for all configured APIs")
-        
-    global app_health
+        config.logger.info(f"Starting {label} collection for all configured APIs")
     
-    # Track configuration collection duration
+    # Track collection duration
     start_time = time.time()
     
     try:
-        # Carica la configurazione delle query
+        # Carica la configurazione delle query e delle API
         queries_config = load_queries_config()
+        api_configs = load_api_config()
         
         # Se non è stata trovata nessuna configurazione, esci
         if queries_config is None:
-            config.logger.error("No queries configuration available, skipping configuration collection")
+            config.logger.error(f"No queries configuration available, skipping {label} collection")
             return
-        
+            
+        # Current time as end time
         now = datetime.now().isoformat()
-        if config.DEBUG:
-            config.logger.debug(f"Starting configuration collection at {now}")
         
-        # Esegui tutte le query di configurazione configurate o solo quella specificata
-        if 'config' in queries_config:
-            for query_config in queries_config['config']:
-                current_api_name = query_config['api_name']
-                
-                # Se è stato specificato un api_name e non corrisponde a quello corrente, salta
-                if api_name and current_api_name != api_name:
-                    continue
-                
-                # Se è specificato un override del nome API, usa quello per la query
-                api_query_name = query_config.get('api_name_override', current_api_name)
-                entity_type = api_query_name.replace('_config', '')  # Remove _config suffix if present
-                
-                config.logger.info(f"Collecting {current_api_name} configuration")
-                if config.DEBUG:
-                    config.logger.debug(f"Using configuration: {json.dumps(query_config)}")
-                
-                try:
-                    # Esegui la query all'API senza passare il site_id
-                    response = citrix_client.query_api(api_query_name)
-                    
-                    if response:
-                        if config.DEBUG:
-                            config.logger.debug(f"Received {len(response) if isinstance(response, list) else 'object'} from {current_api_name} API")
-                        
-                        # Store configuration data using the generic store_entity method
-                        postgres_manager.store_entity(entity_type, response)
-                        config.logger.info(f"Stored {current_api_name} configuration data")
-                    else:
-                        if config.DEBUG:
-                            config.logger.debug(f"No {current_api_name} configuration received or empty response")
-                
-                except Exception as e:
-                    error_msg = f"Error during {current_api_name} configuration collection: {str(e)}"
-                    config.logger.error(error_msg)
-                    
-                    if config.DEBUG:
-                        import traceback
-                        config.logger.debug(f"Detailed error traceback: {traceback.format_exc()}")
-                        
-                    # Increment error counter
-                    if ENABLE_PROMETHEUS_METRICS:
-                        METRICS_COLLECTION_ERRORS.labels(type=f'config_{current_api_name}').inc()
+        if _DEBUG:
+            config.logger.debug(f"Starting {label} collection at {now}")
+        
+        # Esegui tutte le query configurate o solo quella specificata
+        if kind in queries_config:
+            query_configs = [q for q in queries_config[kind] if not api_name or q['api_name'] == api_name]
+            _run_collectors(collector, query_configs, api_configs, kind)
+        
+        if on_success:
+            on_success(now)
         
         # Update health status
-        app_health["status"] = "healthy"
-        app_health["last_config_run"] = now
-    
+        _set_health(**{"status": "healthy", f"last_{kind}_run": now})
+        
     except Exception as e:
-        error_msg = f"Error during configuration collection: {str(e)}"
+        error_msg = f"Error during {label} collection: {str(e)}"
         config.logger.error(error_msg)
-        
-        if config.DEBUG:
-            import traceback
-            config.logger.debug(f"Detailed error traceback: {traceback.format_exc()}")
+        if _DEBUG:
+            config.logger.debug("Detailed error traceback:", exc_info=True)
             
-        app_health["errors"].append({
-            "time": datetime.now().isoformat(),
-            "component": "config_collector",
-            "message": error_msg
-        })
-        # Keep only the last 10 errors
-        if len(app_health["errors"]) > 10:
-            app_health["errors"] = app_health["errors"][-10:]
+        _add_health_error(f"{kind}_collector", error_msg)
         
         # Increment error counter
         if ENABLE_PROMETHEUS_METRICS:
-            METRICS_COLLECTION_ERRORS.labels(type='config').inc()
+            METRICS_COLLECTION_ERRORS.labels(type=kind).inc()
     
     finally:
-        # Record configuration duration
+        # Record collection duration
         duration = time.time() - start_time
         if ENABLE_PROMETHEUS_METRICS:
-            collector_type = f'config_{api_name}' if api_name else 'config'
+            collector_type = f'{kind}_{api_name}' if api_name else kind
             METRICS_COLLECTION_DURATION.labels(type=collector_type).observe(duration)
             
-        if config.DEBUG:
-            config.logger.debug(f"Configuration collection completed in {duration:.2f} seconds")
+        if _DEBUG:
+            config.logger.debug(f"{label.capitalize()} collection completed in {duration:.2f} seconds")
+    
+    config.logger.info(f"{label.capitalize()} collection completed")
+
+def _store_last_metrics_run(now):
+    """Store the current time as the last successful metrics run."""
+    victoria_metrics_manager.store_last_metrics_run(now)
+    if _DEBUG:
+        config.logger.debug(f"Updated last metrics run timestamp to {now}")
+
+def collect_metrics(api_name=None):
+    """
+    Colleziona metriche da Citrix Cloud e le memorizza in VictoriaMetrics.
     
-    config.logger.info("Configuration collection completed")
+    Args:
+        api_name: Se specificato, raccoglie solo le metriche per quell'API specifica
+    """
+    _run_collection('metrics', _collect_one_metric, api_name, on_success=_store_last_metrics_run)
+
+def collect_configurations(api_name=None):
+    """
+    Colleziona dati di configurazione da Citrix Cloud e li memorizza in PostgreSQL.
+    
+    Args:
+        api_name: Se specificato, raccoglie solo la configurazione per quell'API specifica
+    """
+    _run_collection('config', _collect_one_configuration, api_name)
 
 def setup_api_schedulers():
     """
@@ -353,10 +467,16 @@ def setup_api_schedulers():
     api_configs = load_api_config()
     queries_config = load_queries_config()
     
+    # Le prime raccolte girano in background, in parallelo, così l'avvio
+    # non attende la somma delle latenze delle API e /health risponde subito.
+    # Il pool non viene chiuso: le raccolte proseguono accanto allo scheduler.
+    startup_pool = ThreadPoolExecutor(max_workers=COLLECTION_MAX_WORKERS, thread_name_prefix='startup_collection')
+    _set_health(status="running")
+    
     if not api_configs:
         config.logger.warning("No API configurations found. Using default intervals.")
         # Fallback to default global intervals
-        setup_default_schedulers()
+        setup_default_schedulers(startup_pool)
         return
     
     # Scheduling delle metriche
@@ -364,21 +484,24 @@ def setup_api_schedulers():
         for query_config in queries_config['metrics']:
             api_name = query_config['api_name']
             
+            # Genera subito la funzione di estrazione di tag e campi per questa query
+            _get_extractor(query_config)
+            
             if api_name in api_configs and 'polling_interval' in api_configs[api_name]:
                 interval = api_configs[api_name]['polling_interval']
                 config.logger.info(f"Scheduling {api_name} metrics collection every {interval} seconds")
                 
                 # Schedule specific API collection
-                schedule.every(interval).seconds.do(collect_metrics, api_name=api_name)
+                schedule_every(interval, collect_metrics, api_name=api_name)
                 
-                # Run immediately at startup for this API
-                collect_metrics(api_name=api_name)
+                # Run at startup for this API without blocking the setup
+                startup_pool.submit(collect_metrics, api_name=api_name)
             else:
                 # Use default interval if not specified
                 default_interval = config.METRICS_COLLECTION_INTERVAL
                 config.logger.info(f"No specific interval for {api_name}, using default: {default_interval} seconds")
-                schedule.every(default_interval).seconds.do(collect_metrics, api_name=api_name)
-                collect_metrics(api_name=api_name)
+                schedule_every(default_interval, collect_metrics, api_name=api_name)
+                startup_pool.submit(collect_metrics, api_name=api_name)
     
     # Scheduling delle configurazioni
     if queries_config and 'config' in queries_config:
@@ -391,112 +514,172 @@ def setup_api_schedulers():
                 config.logger.info(f"Scheduling {api_name} configuration collection every {interval} seconds")
                 
                 # Schedule specific API configuration collection
-                schedule.every(interval).seconds.do(collect_configurations, api_name=api_name)
+                schedule_every(interval, collect_configurations, api_name=api_name)
                 
-                # Run immediately at startup for this API
-                collect_configurations(api_name=api_name)
+                # Run at startup for this API without blocking the setup
+                startup_pool.submit(collect_configurations, api_name=api_name)
             else:
                 # Use default interval if not specified
                 default_interval = config.CONFIG_COLLECTION_INTERVAL
                 config.logger.info(f"No specific interval for {api_name} configuration, using default: {default_interval} seconds")
-                schedule.every(default_interval).seconds.do(collect_configurations, api_name=api_name)
-                collect_configurations(api_name=api_name)
+                schedule_every(default_interval, collect_configurations, api_name=api_name)
+                startup_pool.submit(collect_configurations, api_name=api_name)
 
-def setup_default_schedulers():
-    """Configura gli scheduler con intervalli globali predefiniti."""
+def setup_default_schedulers(startup_pool):
+    """
+    Configura gli scheduler con intervalli globali predefiniti.
+    
+    Args:
+        startup_pool: Executor usato per eseguire le prime raccolte in background
+    """
     config.logger.info(f"Starting metrics scheduler with interval of {config.METRICS_COLLECTION_INTERVAL} seconds")
-    schedule.every(config.METRICS_COLLECTION_INTERVAL).seconds.do(collect_metrics)
+    schedule_every(config.METRICS_COLLECTION_INTERVAL, collect_metrics)
     
     config.logger.info(f"Starting configuration scheduler with interval of {config.CONFIG_COLLECTION_INTERVAL} seconds")
-    schedule.every(config.CONFIG_COLLECTION_INTERVAL).seconds.do(collect_configurations)
+    schedule_every(config.CONFIG_COLLECTION_INTERVAL, collect_configurations)
     
-    if config.DEBUG:
+    if _DEBUG:
         config.logger.debug(f"Scheduled metrics collection every {config.METRICS_COLLECTION_INTERVAL} seconds")
         config.logger.debug(f"Scheduled configuration collection every {config.CONFIG_COLLECTION_INTERVAL} seconds")
-        config.logger.debug("Running first collections immediately")
+        config.logger.debug("Running first collections in background")
+    
+    # Run at startup without blocking the setup
+    startup_pool.submit(collect_metrics)
+    startup_pool.submit(collect_configurations)
+
+def schedule_every(interval, func, **kwargs):
+    """
+    Pianifica l'esecuzione periodica di func ogni interval secondi.
+    Gli avvii sono allineati all'intervallo, così la durata della raccolta non
+    li fa slittare; gli avvii persi durante una raccolta lenta vengono saltati.
     
-    # Run immediately at startup
-    collect_metrics()
-    collect_configurations()
+    Args:
+        interval: Intervallo in secondi tra due esecuzioni
+        func: Funzione da eseguire
+        **kwargs: Argomenti passati a func
+    """
+    def run(last_fire):
+        try:
+            func(**kwargs)
+        finally:
+            next_fire = last_fire + interval
+            now = time.monotonic()
+            if next_fire <= now:
+                next_fire += ((now - next_fire) // interval + 1) * interval
+            scheduler.enterabs(next_fire, 1, run, argument=(next_fire,))
+    
+    first_fire = time.monotonic() + interval
+    scheduler.enterabs(first_fire, 1, run, argument=(first_fire,))
 
 def run_schedulers():
-    """Esegue tutti gli scheduler configurati."""
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    """Esegue tutti gli scheduler configurati, dormendo fino alla prossima raccolta."""
+    scheduler.run()
+
+# Last rendered Prometheus output as [monotonic render time, bytes]: concurrent or
+# back-to-back scrapes within METRICS_CACHE_TTL seconds reuse it instead of re-rendering
+METRICS_CACHE_TTL = float(os.environ.get('METRICS_CACHE_TTL', '1.0'))
+_metrics_cache = [float('-inf'), b'']
+_metrics_cache_lock = threading.Lock()
+
+def _render_metrics():
+    """Return the Prometheus metrics output, rendering it at most once per METRICS_CACHE_TTL."""
+    with _metrics_cache_lock:
+        now = time.monotonic()
+        if now - _metrics_cache[0] > METRICS_CACHE_TTL:
+            _metrics_cache[:] = [now, generate_latest()]
+        return _metrics_cache[1]
 
 class HTTPHandler(http.server.SimpleHTTPRequestHandler):
     """HTTP request handler for health checks and metrics endpoint."""
     
+    # Keep-alive lets Prometheus reuse the connection across scrapes
+    protocol_version = 'HTTP/1.1'
+    
     def do_GET(self):
         """Handle GET requests to health and metrics endpoints."""
-        if self.path == '/health':
-            if config.DEBUG:
-                config.logger.debug(f"Health check request from {self.client_address[0]}")
-                
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(app_health).encode())
-            
-            if config.DEBUG:
-                config.logger.debug(f"Health check response: {json.dumps(app_health)}")
-                
-        elif self.path == '/metrics':
-            if not ENABLE_PROMETHEUS_METRICS:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b'Prometheus metrics endpoint is disabled')
-                return
-                
-            if config.DEBUG:
-                config.logger.debug(f"Metrics request from {self.client_address[0]}")
-                
-            self.send_response(200)
-            self.send_header('Content-type', CONTENT_TYPE_LATEST)
-            self.end_headers()
-            metrics = generate_latest()
-            self.wfile.write(metrics)
-            
-            if config.DEBUG:
-                config.logger.debug(f"Metrics response size: {len(metrics)} bytes")
-                
+        handler = _ROUTES.get(self.path)
+        if handler:
+            handler(self)
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b'Not Found')
+            self._send(404, b'Not Found')
+    
+    def _send(self, status, body, content_type=None):
+        """Send a complete response with Content-Length, as required for keep-alive."""
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _handle_health(self):
+        """Serve the pre-encoded application health."""
+        if _DEBUG:
+            config.logger.debug(f"Health check request from {self.client_address[0]}")
+        
+        health_bytes = _health_bytes
+        self._send(200, health_bytes, 'application/json')
+        
+        if _DEBUG:
+            config.logger.debug(f"Health check response: {health_bytes.decode()}")
+    
+    def _handle_metrics(self):
+        """Serve the Prometheus metrics."""
+        if _DEBUG:
+            config.logger.debug(f"Metrics request from {self.client_address[0]}")
+        
+        metrics = _render_metrics()
+        self._send(200, metrics, CONTENT_TYPE_LATEST)
+        
+        if _DEBUG:
+            config.logger.debug(f"Metrics response size: {len(metrics)} bytes")
+    
+    def _handle_metrics_disabled(self):
+        """Answer /metrics when Prometheus metrics are disabled."""
+        self._send(404, b'Prometheus metrics endpoint is disabled')
     
     def log_message(self, format, *args):
         """Override to use our logger instead."""
-        if self.path != '/health' and self.path != '/metrics':
+        if self.path not in _ROUTES:
             config.logger.info(f"{self.address_string()} - {format % args}")
 
+# Path -> handler dispatch table, built once at import
+_ROUTES = {
+    '/health': HTTPHandler._handle_health,
+    '/metrics': HTTPHandler._handle_metrics if ENABLE_PROMETHEUS_METRICS else HTTPHandler._handle_metrics_disabled,
+}
+
 def run_http_server():
     """Run the HTTP server for health checks and metrics."""
     try:
-        httpd = socketserver.TCPServer(("", 8000), HTTPHandler)
+        httpd = http.server.ThreadingHTTPServer(("", 8000), HTTPHandler)
         config.logger.info("HTTP server started on port 8000 with /health" + (" and /metrics" if ENABLE_PROMETHEUS_METRICS else ""))
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug("HTTP server is running in debug mode")
         httpd.serve_forever()
     except Exception as e:
         config.logger.error(f"Failed to start HTTP server: {str(e)}")
-        if config.DEBUG:
-            import traceback
-            config.logger.debug(f"HTTP server error details: {traceback.format_exc()}")
+        if _DEBUG:
+            config.logger.debug("HTTP server error details:", exc_info=True)
 
 def signal_handler(sig, frame):
     """Handle termination signals gracefully."""
     config.logger.info("Received termination signal, shutting down...")
-    if config.DEBUG:
+    if _DEBUG:
         config.logger.debug(f"Signal received: {sig}")
+    # Send any log entries still waiting in the VictoriaLogs batcher
+    try:
+        victoria_logs_manager.flush()
+    except Exception as e:
+        if _DEBUG:
+            config.logger.debug(f"Error flushing VictoriaLogs entries: {str(e)}")
     # Close database connections
     try:
         postgres_manager.close()
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug("PostgreSQL connection closed")
     except Exception as e:
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug(f"Error closing PostgreSQL connection: {str(e)}")
     sys.exit(0)
 
@@ -515,7 +698,7 @@ def main():
     config.logger.info(f"Starting Citrix Cloud metrics collector v{app_version}")
     config.logger.info(f"Prometheus metrics endpoint is {'enabled' if ENABLE_PROMETHEUS_METRICS else 'disabled'}")
     
-    if config.DEBUG:
+    if _DEBUG:
         config.logger.debug("Application running in DEBUG mode")
         config.logger.debug(f"Python version: {sys.version}")
         config.logger.debug(f"Process ID: {os.getpid()}")
@@ -547,14 +730,14 @@ def main():
     # Initialize Prometheus metrics if enabled
     if ENABLE_PROMETHEUS_METRICS:
         initialize_metrics(version=app_version)
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug("Prometheus metrics initialized")
     
     # Start HTTP server for health and metrics endpoints
     http_thread = threading.Thread(target=run_http_server)
     http_thread.daemon = True
     http_thread.start()
-    if config.DEBUG:
+    if _DEBUG:
         config.logger.debug("HTTP server thread started")
     
     # Setup schedulers with endpoint-specific intervals
@@ -567,7 +750,7 @@ def main():
     # Start the scheduler thread
     scheduler_thread.start()
     
-    if config.DEBUG:
+    if _DEBUG:
         config.logger.debug("Scheduler thread started")
     
     # Keep the main thread alive
@@ -576,7 +759,7 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         config.logger.info("Application interrupted, shutting down...")
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug("KeyboardInterrupt received")
 
 if __name__ == "__main__":
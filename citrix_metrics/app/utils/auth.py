@@ -1,23 +1,71 @@
-import requests
 import time
+import threading
+from collections import deque
 import json
+from urllib.parse import urlencode
 from datetime import datetime, timedelta
 
 from utils import config
-from utils.retry import retry_with_backoff
+from utils.session import citrix_session, response_json
+from utils.prometheus_metrics import TOKEN_REFRESH_LATENCY, TOKEN_REFRESHES
 from database.postgres_client import postgres_manager
 
+# Il livello del logger dipende da DEBUG: se e' falso i messaggi di debug non vengono
+# nemmeno formattati, perche' tutte le chiamate sono dentro un blocco "if _DEBUG:"
+_DEBUG = config.DEBUG
+
+# Bound once: the token checks run before every API request
+_monotonic = time.monotonic
+
+# Oltre questo numero di refresh in un'ora il buffer di scadenza viene dimezzato
+MAX_REFRESHES_PER_HOUR = 6
+MIN_EXPIRY_BUFFER = 30
+
+# (connect, read) timeouts in seconds for the token request
+AUTH_TIMEOUT = (3.05, 10)
+
+AUTH_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Accept': 'application/json'
+}
+
 class CitrixAuthManager:
     def __init__(self):
         self.client_id = config.CITRIX_CLIENT_ID
         self.client_secret = config.CITRIX_CLIENT_SECRET
         self.auth_url = config.CITRIX_AUTH_URL
+        # Le credenziali non cambiano a runtime: il body del form viene codificato una sola volta
+        # (i valori None vengono omessi, come farebbe requests con un dict)
+        self._auth_body = urlencode({k: v for k, v in (
+            ('grant_type', 'client_credentials'),
+            ('client_id', self.client_id),
+            ('client_secret', self.client_secret)
+        ) if v is not None}).encode('ascii')
         self.token = None
         self.token_expiry = None
+        # Expiry on the monotonic clock, used for the validity checks;
+        # token_expiry (wall clock) is kept only for persistence and logging
+        self._token_expiry_mono = None
+        # (token, header) dell'ultimo header di autorizzazione costruito; va trattato come immutabile
+        self._auth_header = (None, None)
+        # Shared keep-alive session, avoids a new TCP+TLS handshake on every refresh
+        self._session = citrix_session
+        # Serializes token refreshes (and their DB writes) across collector threads
+        self._lock = threading.Lock()
         # Add buffer time to refresh token (5 minutes before expiration)
         self.expiry_buffer = 300
+        # Buffer actually applied, scaled down for short-lived tokens (see get_new_token)
+        self._effective_buffer = self.expiry_buffer
+        # Monotonic deadlines precomputed from the expiry (see _update_deadlines), so the
+        # hot path in get_token is a single float comparison
+        self._refresh_at = 0.0
+        self._prefetch_at = 0.0
+        # Istanti (monotonic) degli ultimi refresh riusciti, per rilevare refresh troppo frequenti
+        self._refresh_times = deque(maxlen=MAX_REFRESHES_PER_HOUR)
+        # Set while a background refresh is running (see _refresh_in_background)
+        self._refreshing = threading.Event()
         
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug(f"CitrixAuthManager initialized with auth URL: {self.auth_url}")
             config.logger.debug(f"Token expiry buffer set to {self.expiry_buffer} seconds")
             
@@ -26,55 +74,54 @@ class CitrixAuthManager:
     
     def _load_token_from_db(self):
         """Carica un token valido dal database se disponibile."""
-        token, expiry = postgres_manager.get_auth_token()
+        # I token dentro il buffer di scadenza vengono scartati direttamente dalla query
+        token, expiry = postgres_manager.get_auth_token(min_ttl_seconds=self.expiry_buffer)
         if token and expiry:
             self.token = token
             self.token_expiry = expiry
-            if config.DEBUG:
-                time_to_expiry = (self.token_expiry - datetime.now()).total_seconds()
+            self._token_expiry_mono = time.monotonic() + (expiry - datetime.now()).total_seconds()
+            self._update_deadlines()
+            # Un token gia' dentro il buffer di scadenza non e' utilizzabile
+            if not self._is_token_valid():
+                if _DEBUG:
+                    config.logger.debug("Token nel database in scadenza, ne verra' richiesto uno nuovo")
+                return False
+            if _DEBUG:
+                time_to_expiry = self._token_expiry_mono - time.monotonic()
                 config.logger.debug(f"Token recuperato dal database, valido per altri {time_to_expiry:.1f} secondi")
             return True
         return False
 
-    @retry_with_backoff()
     def get_new_token(self):
         """
         Get a new bearer token from Citrix Cloud API.
         """
         config.logger.info("Requesting new Citrix Cloud API token")
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'application/json'
-        }
-        
-        payload = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret
-        }
-        
-        if config.DEBUG:
+        if _DEBUG:
             config.logger.debug(f"Auth request URL: {self.auth_url}")
-            config.logger.debug(f"Auth request headers: {headers}")
+            config.logger.debug(f"Auth request headers: {AUTH_HEADERS}")
             # Logging payload without secrets for security
-            safe_payload = payload.copy()
-            safe_payload['client_id'] = safe_payload['client_id'][:5] + '...' if safe_payload['client_id'] else None
-            safe_payload['client_secret'] = '[REDACTED]'
+            safe_payload = {
+                'grant_type': 'client_credentials',
+                'client_id': self.client_id[:5] + '...' if self.client_id else None,
+                'client_secret': '[REDACTED]'
+            }
             config.logger.debug(f"Auth request payload (sanitized): {safe_payload}")
         
-        start_time = time.time()
+        start_time = time.monotonic()
         
         try:
-            response = requests.post(self.auth_url, headers=headers, data=payload)
+            response = self._session.post(self.auth_url, headers=AUTH_HEADERS, data=self._auth_body, timeout=AUTH_TIMEOUT)
             
-            if config.DEBUG:
+            if _DEBUG:
                 config.logger.debug(f"Auth response status code: {response.status_code}")
                 config.logger.debug(f"Auth response headers: {response.headers}")
                 
             response.raise_for_status()
             
-            token_data = response.json()
+            token_data = response_json(response)
             self.token = token_data['access_token']
+            self._auth_header = (self.token, {'Authorization': f'CwsAuth bearer={self.token}'})
             
             # Calculate token expiry time (default to 1 hour if not specified)
             expires_in = token_data.get('expires_in', 3600)
@@ -84,11 +131,17 @@ class CitrixAuthManager:
                 config.logger.warning("Invalid 'expires_in' value, defaulting to 3600 seconds")
                 expires_in = 3600
             self.token_expiry = datetime.now() + timedelta(seconds=expires_in)
+            self._token_expiry_mono = time.monotonic() + expires_in
+            self._adapt_expiry_buffer()
+            # Refresh 10% before expiry (at least 30s, at most expiry_buffer) so short-lived
+            # tokens are not refreshed on every call and long-lived ones are not wasted
+            self._effective_buffer = min(self.expiry_buffer, max(30, int(expires_in * 0.1)))
+            self._update_deadlines()
             
-            # Salva il token nel database
-            postgres_manager.store_auth_token(self.token, self.token_expiry)
+            # Salva il token nel database in background, senza bloccare il chiamante
+            postgres_manager.store_auth_token_async(self.token, self.token_expiry)
             
-            if config.DEBUG:
+            if _DEBUG:
                 # Don't log the full token for security reasons
                 token_preview = self.token[:10] + '...' if self.token else None
                 config.logger.debug(f"Token acquired (first 10 chars): {token_preview}")
@@ -96,49 +149,118 @@ class CitrixAuthManager:
                 config.logger.debug(f"Token expiry timestamp: {self.token_expiry}")
                 
             config.logger.info(f"New token acquired, expires at {self.token_expiry}")
+            TOKEN_REFRESHES.labels(result='success').inc()
             return self.token
         except Exception as e:
+            TOKEN_REFRESHES.labels(result='error').inc()
             config.logger.error(f"Failed to get token: {str(e)}")
-            if config.DEBUG and hasattr(e, 'response') and e.response is not None:
+            if _DEBUG and hasattr(e, 'response') and e.response is not None:
                 config.logger.debug(f"Auth error response status: {e.response.status_code}")
                 config.logger.debug(f"Auth error response content: {e.response.content.decode('utf-8')}")
             raise
         finally:
-            if config.DEBUG:
-                duration = time.time() - start_time
+            duration = time.monotonic() - start_time
+            TOKEN_REFRESH_LATENCY.observe(duration)
+            if _DEBUG:
                 config.logger.debug(f"Auth request duration: {duration:.3f} seconds")
 
+    def _adapt_expiry_buffer(self):
+        """
+        Halve the expiry buffer when tokens are refreshed more than MAX_REFRESHES_PER_HOUR
+        times in an hour, so a buffer too large for the token lifetime does not keep
+        triggering early refreshes.
+        """
+        now = time.monotonic()
+        self._refresh_times.append(now)
+        if (len(self._refresh_times) == MAX_REFRESHES_PER_HOUR and
+                now - self._refresh_times[0] < 3600 and self.expiry_buffer > MIN_EXPIRY_BUFFER):
+            self.expiry_buffer = max(MIN_EXPIRY_BUFFER, self.expiry_buffer // 2)
+            self._refresh_times.clear()
+            config.logger.warning(f"Token refreshed {MAX_REFRESHES_PER_HOUR} times in the last hour, "
+                                  f"expiry buffer reduced to {self.expiry_buffer} seconds")
+
+    def _update_deadlines(self):
+        """Recompute the refresh and prefetch deadlines from the current expiry and buffer."""
+        self._refresh_at = self._token_expiry_mono - self._effective_buffer
+        self._prefetch_at = self._token_expiry_mono - 2 * self._effective_buffer
+
+    def _is_token_valid(self) -> bool:
+        """Return True if there is a token and it is not about to expire."""
+        return bool(self.token) and _monotonic() < self._refresh_at
+
+    def _should_prefetch(self) -> bool:
+        """Return True if the token is still valid but will need a refresh soon."""
+        return _monotonic() >= self._prefetch_at
+
+    def _refresh_in_background(self):
+        """
+        Start a token refresh in a background thread, so the refresh overlaps with
+        the requests in flight instead of blocking a collector once the token expires.
+        """
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+        
+        def refresh():
+            try:
+                with self._lock:
+                    # Skip if another thread already replaced the token
+                    if self._should_prefetch():
+                        self.get_new_token()
+            except Exception as e:
+                # The token is still valid: the next get_token will retry synchronously if needed
+                config.logger.warning(f"Background token refresh failed: {str(e)}")
+            finally:
+                self._refreshing.clear()
+        
+        threading.Thread(target=refresh, name="token-refresh", daemon=True).start()
+
     def get_token(self):
         """
         Get a valid bearer token, reusing existing one if valid, or acquiring new one if needed.
+        Only one thread refreshes the token; the others wait and reuse the new one.
+        A token close to the expiry buffer is refreshed ahead of time in the background.
         """
-        # If no token exists or token is about to expire, get a new one
-        if (not self.token or not self.token_expiry or 
-            datetime.now() > (self.token_expiry - timedelta(seconds=self.expiry_buffer))):
-            if config.DEBUG:
-                if not self.token:
-                    config.logger.debug("No existing token, requesting new one")
-                elif not self.token_expiry:
-                    config.logger.debug("Token expiry not set, requesting new token")
-                else:
-                    time_to_expiry = (self.token_expiry - datetime.now()).total_seconds()
-                    config.logger.debug(f"Token expires in {time_to_expiry:.1f} seconds, refreshing token")
-            return self.get_new_token()
-        
-        if config.DEBUG:
-            time_to_expiry = (self.token_expiry - datetime.now()).total_seconds()
-            config.logger.debug(f"Reusing existing token, valid for {time_to_expiry:.1f} more seconds")
-        else:
-            config.logger.debug("Reusing existing token")
+        # Fast path without locking when the current token is still valid
+        token = self.token
+        now = _monotonic()
+        if token and now < self._refresh_at:
+            if now >= self._prefetch_at:
+                self._refresh_in_background()
+            if _DEBUG:
+                config.logger.debug(f"Reusing existing token, valid for {self._token_expiry_mono - now:.1f} more seconds")
+            return token
         
-        return self.token
+        with self._lock:
+            # Re-check: another thread may have refreshed while we waited for the lock
+            if not self._is_token_valid():
+                if _DEBUG:
+                    if not self.token:
+                        config.logger.debug("No existing token, requesting new one")
+                    elif self._token_expiry_mono is None:
+                        config.logger.debug("Token expiry not set, requesting new token")
+                    else:
+                        time_to_expiry = self._token_expiry_mono - time.monotonic()
+                        config.logger.debug(f"Token expires in {time_to_expiry:.1f} seconds, refreshing token")
+                return self.get_new_token()
+            
+            if _DEBUG:
+                config.logger.debug("Token was refreshed by another thread, reusing it")
+            return self.token
+
 
     def get_auth_header(self):
         """
         Return the authorization header with a valid token.
+        The dict is cached until the token changes and must not be modified by callers.
         """
         token = self.get_token()
-        return {'Authorization': f'CwsAuth bearer={token}'}
+        cached_token, header = self._auth_header
+        if cached_token != token:
+            # Token loaded from the database or replaced since the header was built
+            header = {'Authorization': f'CwsAuth bearer={token}'}
+            self._auth_header = (token, header)
+        return header
 
 # Create a singleton instance of the auth manager
 auth_manager = CitrixAuthManager()
\ No newline at end of file
@@ -1,8 +1,21 @@
 import os
 from dotenv import load_dotenv
 import logging
+import logging.handlers
+import queue
+import atexit
+import functools
+import json
 import yaml
 
+# Prefer the libyaml C loader, falling back to the pure Python one if libyaml is not available.
+# The PyYAML manylinux wheels bundle libyaml; when building from source, install libyaml-dev
+# before `pip install pyyaml` so the C extension gets compiled.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 # Load environment variables from .env file if present
 load_dotenv()
 
@@ -10,11 +23,23 @@ load_dotenv()
 DEBUG = os.environ.get('DEBUG', 'false').lower() in ('true', '1', 't', 'yes')
 
 # Configure logging
+# Callers only enqueue the records; formatting and writing to stderr happen in the
+# QueueListener thread, which owns the real StreamHandler and its formatter
+_log_queue = queue.Queue(-1)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# The queue handler only merges message and arguments (and any traceback) into the record
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
 logging.basicConfig(
     level=logging.DEBUG if DEBUG else logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler()
+        _queue_handler
     ]
 )
 
@@ -22,6 +47,7 @@ logger = logging.getLogger('citrix_metrics')
 
 if DEBUG:
     logger.debug("Debug mode is enabled")
+    logger.debug(f"YAML loader: {YamlLoader.__name__}")
 
 # Citrix Cloud API Configuration
 CITRIX_CLIENT_ID = os.environ.get('CITRIX_CLIENT_ID')
@@ -49,6 +75,9 @@ METRICS_ENDPOINT = os.environ.get('METRICS_ENDPOINT', 'http://victoriametrics:84
 # The URL per requirements: http://localhost:9428/insert/jsonline?_msg_field=fields.message&_time_field=timestamp,_stream_fields=tags.log_source,tags.metric_type
 # We'll use the base URL here and add the query parameters in the client
 VICTORIA_LOGS_URL = os.environ.get('VICTORIA_LOGS_URL', 'http://victorialogs:9428/insert/jsonline')
+# Batching of log entries sent to VictoriaLogs (max entries per request, max wait in seconds)
+VICTORIA_LOGS_BATCH_SIZE = int(os.environ.get('VICTORIA_LOGS_BATCH_SIZE', '500'))
+VICTORIA_LOGS_FLUSH_INTERVAL = float(os.environ.get('VICTORIA_LOGS_FLUSH_INTERVAL', '0.1'))
 
 # PostgreSQL Configuration for Settings/Configurations
 POSTGRES_HOST = os.environ.get('POSTGRES_HOST', 'postgres')
@@ -61,6 +90,12 @@ POSTGRES_PASSWORD = os.environ.get('POSTGRES_PASSWORD', 'postgres')
 METRICS_COLLECTION_INTERVAL = int(os.environ.get('METRICS_COLLECTION_INTERVAL', '300'))  # 5 minutes default
 CONFIG_COLLECTION_INTERVAL = int(os.environ.get('CONFIG_COLLECTION_INTERVAL', '3600'))   # 1 hour default
 
+# Size of the HTTP connection pool used for Citrix API calls
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '16'))
+
+# Responses larger than this (in bytes) are parsed incrementally when streaming is requested
+STREAM_THRESHOLD_BYTES = int(os.environ.get('STREAM_THRESHOLD_BYTES', str(5 * 1024 * 1024)))
+
 # Retry configuration
 MAX_RETRIES = int(os.environ.get('MAX_RETRIES', '3'))
 RETRY_BACKOFF_FACTOR = float(os.environ.get('RETRY_BACKOFF_FACTOR', '0.5'))
@@ -69,8 +104,10 @@ RETRY_MAX_WAIT = int(os.environ.get('RETRY_MAX_WAIT', '30'))
 # Timestamp storage file for metrics collection
 LAST_METRICS_RUN_FILE = os.environ.get('LAST_METRICS_RUN_FILE', '/app/data/last_metrics_run.txt')
 
-# Make sure data directory exists
-os.makedirs(os.path.dirname(LAST_METRICS_RUN_FILE), exist_ok=True)
+@functools.lru_cache(maxsize=None)
+def ensure_data_dir():
+    """Make sure the data directory exists; called before the first write, not at import."""
+    os.makedirs(os.path.dirname(LAST_METRICS_RUN_FILE), exist_ok=True)
 
 def validate_config():
     """Validate that all required configuration parameters are set."""
@@ -92,11 +129,88 @@ def validate_config():
     
     return True
 
+# Cache for parsed configuration files: path -> ((st_mtime_ns, st_size, st_ino), data)
+# The stat signature catches both in-place edits and atomic-rename replacements.
+_config_file_cache = {}
+
+def load_yaml_cached(path):
+    """
+    Loads a YAML file, reusing the previously parsed content if the file
+    has not changed since the last load.
+    
+    Args:
+        path: Path of the YAML file
+    
+    Returns:
+        Parsed YAML content
+    """
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _config_file_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    data = _load_json_snapshot(path, key)
+    if data is None:
+        with open(path, 'r') as f:
+            data = yaml_load(f)
+        _write_json_snapshot(path, key, data)
+    _config_file_cache[path] = (key, data)
+    logger.info(f"Loaded configuration from {path}")
+    return data
+
+def yaml_load(stream):
+    """Parse YAML content with the fastest available safe loader."""
+    return yaml.load(stream, Loader=YamlLoader)
+
+# YAML files whose JSON snapshot could not be written; not retried until restart
+_snapshot_write_failed = set()
+
+def _snapshot_path(path):
+    """Path of the JSON snapshot of a YAML file, in the data directory rather than next to the config."""
+    return os.path.join(os.path.dirname(LAST_METRICS_RUN_FILE), os.path.basename(path) + '.cache.json')
+
+def _load_json_snapshot(path, key):
+    """
+    Returns the content of the JSON snapshot of a YAML file if it was taken
+    from that file with the given stat signature, None otherwise.
+    """
+    try:
+        with open(_snapshot_path(path), 'r') as f:
+            snapshot = json.load(f)
+        if snapshot.get('path') != path or snapshot.get('source') != list(key):
+            return None
+        return snapshot.get('data')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _write_json_snapshot(path, key, data):
+    """
+    Writes a JSON snapshot of parsed YAML content to the data directory, so the
+    next process start can skip YAML parsing. Content that does not survive a
+    JSON round-trip (e.g. dates or non-string keys) is not snapshotted.
+    If the snapshot cannot be written (e.g. a read-only data directory) a warning
+    is logged once and later reloads of the same file do not try again.
+    """
+    if path in _snapshot_write_failed:
+        return
+    try:
+        dumped = json.dumps({'path': path, 'source': list(key), 'data': data})
+        if json.loads(dumped)['data'] != data:
+            return
+        ensure_data_dir()
+        with open(_snapshot_path(path), 'w') as f:
+            f.write(dumped)
+    except (OSError, TypeError, ValueError) as e:
+        _snapshot_write_failed.add(path)
+        logger.warning(f"Could not write JSON snapshot for {path}, continuing without it: {str(e)}")
+
 def load_api_config():
     """
     Loads the API configuration from the specified file.
     If the file is not found, it tries a fallback path.
     If still not found, returns an empty dictionary.
+    The parsed file is cached until its modification time changes.
     
     Returns:
         dict: API configuration as a dictionary
@@ -114,33 +228,21 @@ def load_api_config():
             return {}
     
     try:
-        with open(api_config_path, 'r') as f:
-            api_configs = yaml.safe_load(f)
-            logger.info(f"Loaded API configurations from {api_config_path}")
-            return api_configs
+        return load_yaml_cached(api_config_path)
     except Exception as e:
         logger.error(f"Error loading API configurations: {str(e)}")
         return {}
 
-# Cache for queries configuration
-_queries_config_cache = None
-
 def load_queries_config():
     """
     Loads the queries configuration from the specified file.
-    Uses caching to avoid reading the file multiple times.
+    Uses caching to avoid parsing the file again until its modification time changes.
     If the file is not found, it tries a fallback path.
     If still not found, returns None.
     
     Returns:
         dict: Queries configuration as a dictionary or None if not found
     """
-    global _queries_config_cache
-    
-    # Return cached config if already loaded
-    if _queries_config_cache is not None:
-        return _queries_config_cache
-        
     queries_config_path = os.environ.get('QUERIES_CONFIG_PATH', '/etc/citrix_metrics/queries_config.yaml')
     
     # Try primary location
@@ -154,11 +256,7 @@ def load_queries_config():
             return None
     
     try:
-        with open(queries_config_path, 'r') as f:
-            queries_config = yaml.safe_load(f)
-            logger.info(f"Loaded queries configuration from {queries_config_path}")
-            _queries_config_cache = queries_config
-            return queries_config
+        return load_yaml_cached(queries_config_path)
     except Exception as e:
         logger.error(f"Error loading queries configuration: {str(e)}")
-        return None
\ No newline at end of file
+        return None
@@ -1,3 +1,5 @@
+import functools
+
 from prometheus_client import Counter, Histogram, Gauge, Info
 
 # API request metrics
@@ -14,6 +16,38 @@ API_LATENCY = Histogram(
     buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
 )
 
+@functools.lru_cache(maxsize=256)
+def get_api_counters(endpoint, method):
+    """
+    Return the labelled API metrics for an endpoint and method, resolved once
+    so each request only does .inc()/.observe() on the bound children.
+    
+    Args:
+        endpoint: API endpoint
+        method: HTTP method
+    
+    Returns:
+        dict: {'success': Counter, 'error': Counter, 'timer': Histogram}
+    """
+    return {
+        'success': API_REQUESTS.labels(endpoint=endpoint, method=method, status='success'),
+        'error': API_REQUESTS.labels(endpoint=endpoint, method=method, status='error'),
+        'timer': API_LATENCY.labels(endpoint=endpoint, method=method)
+    }
+
+# Authentication metrics
+TOKEN_REFRESH_LATENCY = Histogram(
+    'citrix_auth_token_refresh_seconds',
+    'Latency of Citrix Cloud token requests in seconds',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+TOKEN_REFRESHES = Counter(
+    'citrix_auth_token_refreshes_total',
+    'Total number of Citrix Cloud token requests',
+    ['result']
+)
+
 # Metrics collection metrics
 METRICS_COLLECTION_DURATION = Histogram(
     'citrix_metrics_collection_duration_seconds',
@@ -0,0 +1,70 @@
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from utils import config
+
+# orjson parses response bodies several times faster than the stdlib decoder;
+# both raise a ValueError subclass on invalid JSON
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+def response_json(response):
+    """
+    Decode the JSON body of a response.
+    
+    Args:
+        response: requests.Response with a JSON body
+    
+    Returns:
+        The decoded JSON content
+    """
+    return json_loads(response.content)
+
+class CappedRetry(Retry):
+    """
+    Retry with the backoff between attempts capped at RETRY_MAX_WAIT seconds.
+    urllib3 1.26 (the version required by requests 2.28) reads the cap from this class
+    attribute, kept by the copies made with Retry.new(); urllib3 2 takes it as backoff_max.
+    """
+    DEFAULT_BACKOFF_MAX = config.RETRY_MAX_WAIT
+
+_BACKOFF_MAX_KWARGS = {'backoff_max': config.RETRY_MAX_WAIT} if int(urllib3.__version__.split('.')[0]) >= 2 else {}
+
+def create_session():
+    """
+    Create an HTTP session with a connection pool large enough for the
+    collectors running in parallel.
+    
+    Returns:
+        requests.Session: The configured session
+    """
+    session = requests.Session()
+    # Transient failures are retried inside urllib3, on the same pooled connection.
+    # raise_on_status=False returns the last response once retries are exhausted,
+    # so callers still get an HTTPError from raise_for_status()
+    retry = CappedRetry(
+        total=config.MAX_RETRIES,
+        backoff_factor=config.RETRY_BACKOFF_FACTOR,
+        **_BACKOFF_MAX_KWARGS,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_SIZE, pool_maxsize=config.HTTP_POOL_SIZE,
+                          max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    
+    if config.DEBUG:
+        config.logger.debug(f"HTTP session initialized with pool size {config.HTTP_POOL_SIZE}, max retries {config.MAX_RETRIES}")
+    
+    return session
+
+# Session shared by all Citrix Cloud calls (authentication and API), so token
+# refreshes reuse the keep-alive connections opened by the API client
+citrix_session = create_session()
@@ -1,19 +1,23 @@
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
 import httpx
 import os
-import re
 import logging
 import ssl
 import time
-import json
+import itertools
+import functools
+import orjson
 import traceback
-from typing import Dict, Any, Optional
+from typing import Optional
 
 # Importare le librerie OpenTelemetry per il tracciamento
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBasedTraceIdRatio
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
@@ -41,14 +45,24 @@ if JAEGER_ENABLED:
     
     # Configure the tracer
     resource = Resource.create({"service.name": "infinity_proxy"})
-    tracer_provider = TracerProvider(resource=resource)
+    # Head-based sampling: only a fraction of the root requests is traced
+    sample_ratio = float(os.getenv("OTEL_SAMPLE_RATIO", "0.1"))
+    tracer_provider = TracerProvider(resource=resource, sampler=ParentBasedTraceIdRatio(sample_ratio))
+    logger.info(f"Trace sampling ratio: {sample_ratio}")
     
     # Configure the OTLP exporter
     otlp_endpoint = f"http://{JAEGER_HOST}:{JAEGER_PORT}"
     otlp_exporter = OTLPSpanExporter(endpoint=otlp_endpoint, insecure=True)
     
-    # Add span processor
-    span_processor = BatchSpanProcessor(otlp_exporter)
+    # Add span processor, tuned for bursts of proxied requests (larger queue, smaller and
+    # more frequent batches); each value can be overridden with the standard OTEL_BSP_* variables
+    span_processor = BatchSpanProcessor(
+        otlp_exporter,
+        max_queue_size=int(os.getenv("OTEL_BSP_MAX_QUEUE_SIZE", "4096")),
+        schedule_delay_millis=float(os.getenv("OTEL_BSP_SCHEDULE_DELAY", "1000")),
+        max_export_batch_size=int(os.getenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "256")),
+        export_timeout_millis=float(os.getenv("OTEL_BSP_EXPORT_TIMEOUT", "10000")),
+    )
     tracer_provider.add_span_processor(span_processor)
     
     # Set the tracer provider
@@ -65,80 +79,173 @@ app = FastAPI(title="Citrix Cloud Proxy Middleware")
 # Read configuration from environment variables
 DEFAULT_TARGET_HOST = os.getenv("DEFAULT_TARGET_HOST", "https://api.cloud.com")
 TARGET_HOST = os.getenv("TARGET_HOST", "api.cloud.com")
-DEBUG_MODE = os.getenv("DEBUG", "false").lower() in ("true", "1", "yes")
 
-if DEBUG_MODE:
-    logger.debug("DEBUG_MODE is enabled - verbose logging will be active")
-    logger.debug(f"Configuration: DEFAULT_TARGET_HOST={DEFAULT_TARGET_HOST}, TARGET_HOST={TARGET_HOST}")
+# Debug output is driven by the logger level (set from DEBUG above): expensive log
+# arguments are computed only when logger.isEnabledFor(logging.DEBUG) is true
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Debug logging is enabled - verbose logging will be active")
+    logger.debug("Configuration: DEFAULT_TARGET_HOST=%s, TARGET_HOST=%s", DEFAULT_TARGET_HOST, TARGET_HOST)
 
 # Function to get proxy URL from environment variables, supporting both uppercase and lowercase
+@functools.lru_cache(maxsize=1)
 def get_proxy_url() -> Optional[str]:
     """
     Get proxy configuration from environment variables.
     Supports both HTTP_PROXY/HTTPS_PROXY and http_proxy/https_proxy formats.
     Returns None if no proxy is configured.
+    The environment does not change at runtime, so the result (and its log line) is computed once.
     """
     # Check for HTTP_PROXY in uppercase or lowercase
     proxy = os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
     if proxy:
-        logger.info(f"Using proxy: {proxy}")
+        logger.info("Using proxy: %s", proxy)
         return proxy
     
     logger.info("No proxy configured, connecting directly")
     return None
 
 
-async def modify_request(request: Request) -> Dict[str, Any]:
-    """Modify the request headers before forwarding."""
-    headers = dict(request.headers)
+# Create an SSL context that allows for SNI (equivalent to proxy_ssl_server_name on).
+# Built once: loading the CA bundle is expensive
+_SSL_CTX = ssl.create_default_context()
+_SSL_CTX.check_hostname = True
+
+# Proxy configuration read once from environment variables
+_PROXY_URL = get_proxy_url()
+
+# Single instrumentor, applied to the shared client when it is created
+_HTTPX_INSTRUMENTOR = HTTPXClientInstrumentor() if JAEGER_ENABLED else None
+
+# Per-process request counter used to build unique request ids
+_request_counter = itertools.count(1)
+
+# Framing headers not forwarded when streaming the upstream response
+_STREAM_DROP_HEADERS = frozenset((b"content-length", b"transfer-encoding"))
+# Headers removed from buffered responses, whose content httpx has already decompressed
+_HOP_HEADERS = frozenset((b"content-length", b"content-encoding", b"transfer-encoding"))
+
+
+def filter_headers(raw_headers, drop):
+    """
+    Build the list of (name, value) byte pairs to send back to the client in a
+    single pass over the upstream raw headers, skipping the names in drop.
+    Names are lowercased as required by ASGI; repeated headers are preserved.
+    """
+    result = []
+    for key, value in raw_headers:
+        key = key.lower()
+        if key not in drop:
+            result.append((key, value))
+    return result
+
+
+def create_client() -> httpx.AsyncClient:
+    """
+    Create the HTTP client shared by all proxied requests, so connections to the
+    target host are kept alive and reused (and multiplexed over HTTP/2).
+    """
+    proxies = _PROXY_URL
+    proxy_config = {"http://": proxies, "https://": proxies} if proxies else None
+    
+    # Don't use proxy for Jaeger/OpenTelemetry requests
+    mounts = {f"all://{JAEGER_HOST}": None} if JAEGER_ENABLED and proxies else None
+    
+    client = httpx.AsyncClient(
+        base_url=DEFAULT_TARGET_HOST,
+        http2=True,
+        verify=_SSL_CTX,  # Use custom SSL context that enables SNI
+        proxies=proxy_config,
+        mounts=mounts,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(
+            connect=10.0,    # Maximum time to establish connection
+            read=30.0,       # Maximum time to read data
+            write=10.0,      # Maximum time to write data
+            pool=30.0        # Maximum time to wait for a connection from the pool
+        )
+    )
+    
+    if proxies:
+        logger.info("Created client with proxy configuration: %s", proxies)
+    
+    # Initialize HTTPX instrumentation once if tracing is enabled
+    if _HTTPX_INSTRUMENTOR is not None:
+        _HTTPX_INSTRUMENTOR.instrument_client(client)
+    
+    return client
+
+
+@app.on_event("startup")
+async def startup_client():
+    """Create the shared HTTP client."""
+    debug = logger.isEnabledFor(logging.DEBUG)
+    app.state.client = create_client()
+    if debug:
+        logger.debug("Shared HTTP client created successfully with timeout settings")
+
+
+@app.on_event("shutdown")
+async def shutdown_client():
+    """Close the shared HTTP client and its pooled connections."""
+    await app.state.client.aclose()
+
+
+async def modify_request(request: Request) -> MutableHeaders:
+    """
+    Modify the request headers before forwarding.
+    Works on a case-insensitive view of the raw ASGI headers, without building a dict.
+    """
+    headers = MutableHeaders(raw=list(request.scope["headers"]))
+    debug = logger.isEnabledFor(logging.DEBUG)
     
-    if DEBUG_MODE:
-        logger.debug(f"Original request headers: {headers}")
+    if debug:
+        logger.debug("Original request headers: %s", headers)
     
     # Rewrite Authorization header (similar to Nginx rewrite)
     auth_header = headers.get("authorization")
     if auth_header and auth_header.startswith("Bearer "):
         # Extract the token and reformat it
-        token = re.match(r"^Bearer (.+)$", auth_header)
+        token = auth_header[7:].strip()
         if token:
-            headers["authorization"] = f"CwsAuth Bearer {token.group(1)}"
+            headers["authorization"] = f"CwsAuth Bearer {token}"
             logger.info("Transformed Bearer token to CwsAuth Bearer token")
-            if DEBUG_MODE:
+            if debug:
                 logger.debug("Authorization header transformed successfully")
     
     # Set Host header to match Nginx proxy_set_header Host value
     headers["host"] = TARGET_HOST
-    if DEBUG_MODE:
-        logger.debug(f"Set Host header to: {TARGET_HOST}")
+    if debug:
+        logger.debug("Set Host header to: %s", TARGET_HOST)
     
     # Keep Citrix-CustomerId header as is (equivalent to set $citrix_customerid $http_citrix_customerid)
     if "citrix-customerid" in headers:
-        logger.info(f"Found Citrix-CustomerId header: {headers['citrix-customerid']}")
+        logger.info("Found Citrix-CustomerId header: %s", headers['citrix-customerid'])
     
     # Ensure Accept header is set (equivalent to proxy_set_header Accept application/json)
     headers["accept"] = "application/json"
-    if DEBUG_MODE:
+    if debug:
         logger.debug("Set Accept header to: application/json")
     
-    # Clean up any headers we don't want to forward
-    if "content-length" in headers:
-        if DEBUG_MODE:
-            logger.debug("Removing content-length header from request")
-        del headers["content-length"]
+    # Clean up any headers we don't want to forward. Content-Length is kept, since the
+    # body is forwarded unchanged: with it httpx streams the body without chunked encoding
+    if "transfer-encoding" in headers:
+        if debug:
+            logger.debug("Removing transfer-encoding header from request")
+        del headers["transfer-encoding"]
     
     # Add X-Forwarded headers if needed
     remote_addr = request.client.host if request.client else "unknown"
     if "x-forwarded-for" in headers:
         headers["x-forwarded-for"] = f"{headers['x-forwarded-for']}, {remote_addr}"
-        if DEBUG_MODE:
-            logger.debug(f"Appended client IP to X-Forwarded-For: {headers['x-forwarded-for']}")
+        if debug:
+            logger.debug("Appended client IP to X-Forwarded-For: %s", headers['x-forwarded-for'])
     else:
         headers["x-forwarded-for"] = remote_addr
-        if DEBUG_MODE:
-            logger.debug(f"Set X-Forwarded-For header to: {remote_addr}")
+        if debug:
+            logger.debug("Set X-Forwarded-For header to: %s", remote_addr)
     
-    if DEBUG_MODE:
-        logger.debug(f"Modified headers: {headers}")
+    if debug:
+        logger.debug("Modified headers: %s", headers)
     return headers
 
 
@@ -148,7 +255,11 @@ async def proxy_endpoint(request: Request, path: str):
     Main proxy endpoint that handles all incoming requests and forwards them to the target.
     Rewrites authentication headers before forwarding and sets all required headers.
     """
-    request_id = f"req-{int(time.time() * 1000)}"
+    # Health probes are answered directly, without creating spans or forwarding
+    if path == "health":
+        return {"status": "ok"}
+    
+    request_id = f"req-{next(_request_counter):x}"
     current_span = None
     
     # Create a span for this request if tracing is enabled
@@ -175,90 +286,58 @@ async def handle_request(request: Request, path: str, request_id: str, span: Opt
     """
     Handle the proxy request logic, with optional tracing span support.
     """
-    # Log request details if in debug mode
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Received request: {request.method} {request.url.path}")
-        logger.debug(f"[{request_id}] Query parameters: {dict(request.query_params)}")
-        logger.debug(f"[{request_id}] Client IP: {request.client.host if request.client else 'unknown'}")
+    debug = logger.isEnabledFor(logging.DEBUG)
     
-    # Create an SSL context that allows for SNI (equivalent to proxy_ssl_server_name on)
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = True
-    
-    # Get proxy configuration from environment variables
-    proxies = get_proxy_url()
+    # Log request details if in debug mode
+    if debug:
+        logger.debug("[%s] Received request: %s %s", request_id, request.method, request.url.path)
+        logger.debug("[%s] Query parameters: %s", request_id, request.query_params)
+        logger.debug("[%s] Client IP: %s", request_id, request.client.host if request.client else 'unknown')
     
-    # Create client with the correct configurations for handling compressed responses
-    try:
-        # Don't use proxy for Jaeger/OpenTelemetry requests
-        target_host = request.url.hostname or TARGET_HOST
-        if JAEGER_ENABLED and target_host == JAEGER_HOST:
-            proxy_config = None
-            if DEBUG_MODE:
-                logger.debug(f"[{request_id}] Skipping proxy for Jaeger request to {target_host}")
-        else:
-            proxy_config = {"http://": proxies, "https://": proxies} if proxies else None
-
-        client = httpx.AsyncClient(
-            http2=True,
-            verify=ssl_context,  # Use custom SSL context that enables SNI
-            proxies=proxy_config,
-            timeout=httpx.Timeout(
-                connect=10.0,    # Maximum time to establish connection
-                read=30.0,       # Maximum time to read data
-                write=10.0,      # Maximum time to write data
-                pool=30.0        # Maximum time to wait for a connection from the pool
-            )
-        )
-        
-        if proxies:
-            logger.info(f"[{request_id}] Created client with proxy configuration: {proxies}")
-        
-        # Initialize HTTPX instrumentation if tracing is enabled
-        if JAEGER_ENABLED and span is not None:
-            HTTPXClientInstrumentor().instrument_client(client)
-        
-        if DEBUG_MODE:
-            logger.debug(f"[{request_id}] Client created successfully with timeout settings")
-    except Exception as e:
-        error_msg = f"Failed to create HTTP client: {str(e)}"
-        logger.error(f"[{request_id}] {error_msg}")
-        if span is not None:
-            span.set_attribute("error", True)
-            span.set_attribute("error.message", error_msg)
-        return Response(content=error_msg, status_code=500)
+    # Shared client created at startup (see startup_client)
+    client = request.app.state.client
     
-    # Get the target URL
-    target_url = f"{DEFAULT_TARGET_HOST}/{path}"
-    if request.query_params:
-        target_url += f"?{request.url.query}"
+    # Get the target URL, relative to the client base_url (DEFAULT_TARGET_HOST), from the route path:
+    # leading slashes are collapsed so a path like "//x/foo" is not read as a network-path reference
+    # (which would drop its first segment), and the query string is forwarded as received
+    target_url = "/" + path.lstrip("/")
+    query_string = request.scope.get("query_string")
+    if query_string:
+        target_url += "?" + query_string.decode("latin-1")
         
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Forwarding to target URL: {target_url}")
+    if debug:
+        logger.debug("[%s] Forwarding to target URL: %s%s", request_id, DEFAULT_TARGET_HOST, target_url)
     
     if span is not None:
-        span.set_attribute("http.target_url", target_url)
+        span.set_attribute("http.target_url", DEFAULT_TARGET_HOST + target_url)
     
-    # Get the request body
-    body = await request.body()
-    if DEBUG_MODE and body:
-        body_size = len(body)
-        logger.debug(f"[{request_id}] Request body size: {body_size} bytes")
-        if body_size < 4096:  # Only log bodies smaller than 4KB to prevent log flooding
-            try:
-                # Try to decode as JSON for nicer logging
+    # Get the request body. It is buffered only in debug mode, where it is logged;
+    # otherwise it is streamed to the target while it is still being received
+    if debug:
+        body = await request.body()
+        if body:
+            body_size = len(body)
+            logger.debug("[%s] Request body size: %s bytes", request_id, body_size)
+            if body_size < 4096:  # Only log bodies smaller than 4KB to prevent log flooding
                 try:
-                    json_body = json.loads(body)
-                    logger.debug(f"[{request_id}] Request body (JSON): {json.dumps(json_body, indent=2)}")
-                except json.JSONDecodeError:
-                    # Not JSON, log as text if possible
+                    # Try to decode as JSON for nicer logging
                     try:
-                        text_body = body.decode('utf-8')
-                        logger.debug(f"[{request_id}] Request body (text): {text_body}")
-                    except UnicodeDecodeError:
-                        logger.debug(f"[{request_id}] Request body is binary data (not logged)")
-            except Exception as e:
-                logger.debug(f"[{request_id}] Error while logging request body: {str(e)}")
+                        json_body = orjson.loads(body)
+                        logger.debug("[%s] Request body (JSON): %s", request_id, orjson.dumps(json_body, option=orjson.OPT_INDENT_2).decode())
+                    except orjson.JSONDecodeError:
+                        # Not JSON, log as text if possible
+                        try:
+                            text_body = body.decode('utf-8')
+                            logger.debug("[%s] Request body (text): %s", request_id, text_body)
+                        except UnicodeDecodeError:
+                            logger.debug("[%s] Request body is binary data (not logged)", request_id)
+                except Exception as e:
+                    logger.debug("[%s] Error while logging request body: %s", request_id, str(e))
+    elif "content-length" in request.headers or "transfer-encoding" in request.headers:
+        body = request.stream()
+    else:
+        # No body (e.g. GET): avoid sending an empty chunked body
+        body = None
     
     # Get and modify headers
     headers = await modify_request(request)
@@ -267,19 +346,20 @@ async def handle_request(request: Request, path: str, request_id: str, span: Opt
     
     try:
         # Forward the request to the target
-        if DEBUG_MODE:
-            logger.debug(f"[{request_id}] Sending {request.method} request to {target_url}")
+        if debug:
+            logger.debug("[%s] Sending %s request to %s", request_id, request.method, target_url)
         
         if span is not None:
             span.add_event("sending_request")
         
-        response = await client.request(
+        # The body is not read here: it is streamed back to the caller as it arrives
+        upstream_request = client.build_request(
             method=request.method,
             url=target_url,
-            headers=headers,
+            headers=headers.raw,
             content=body,
-            follow_redirects=True,
         )
+        response = await client.send(upstream_request, stream=True, follow_redirects=True)
         
         elapsed = time.time() - start_time
         
@@ -288,59 +368,62 @@ async def handle_request(request: Request, path: str, request_id: str, span: Opt
             span.set_attribute("http.status_code", response.status_code)
             span.set_attribute("http.response_time", elapsed)
         
-        if DEBUG_MODE:
-            logger.debug(f"[{request_id}] Received response from {target_url} in {elapsed:.3f}s: status={response.status_code}")
-            logger.debug(f"[{request_id}] Response headers: {dict(response.headers)}")
+        if debug:
+            logger.debug("[%s] Received response from %s in %.3fs: status=%s", request_id, target_url, elapsed, response.status_code)
+            logger.debug("[%s] Response headers: %s", request_id, response.headers)
         
-        # Read the content first to prevent StreamConsumed error
-        content = await response.aread()
+        if not debug:
+            # Forward the raw (still compressed, if so encoded) bytes without buffering them;
+            # only the hop-by-hop framing headers are dropped, the server re-frames the stream
+            if span is not None and "content-length" in response.headers:
+                span.set_attribute("http.response_size", int(response.headers["content-length"]))
+            
+            streaming_response = StreamingResponse(
+                response.aiter_raw(),
+                status_code=response.status_code,
+                background=BackgroundTask(response.aclose),
+            )
+            streaming_response.raw_headers.extend(filter_headers(response.headers.raw, _STREAM_DROP_HEADERS))
+            return streaming_response
+        
+        # In debug mode the content is buffered (and decompressed) so it can be logged
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
         
         if span is not None:
             span.set_attribute("http.response_size", len(content))
         
-        if DEBUG_MODE and content:
+        if content:
             content_size = len(content)
-            logger.debug(f"[{request_id}] Response content size: {content_size} bytes")
+            logger.debug("[%s] Response content size: %s bytes", request_id, content_size)
             if content_size < 4096:  # Only log responses smaller than 4KB
                 try:
                     # Try to decode as JSON for nicer logging
                     try:
-                        json_content = json.loads(content)
-                        logger.debug(f"[{request_id}] Response content (JSON): {json.dumps(json_content, indent=2)}")
-                    except json.JSONDecodeError:
+                        json_content = orjson.loads(content)
+                        logger.debug("[%s] Response content (JSON): %s", request_id, orjson.dumps(json_content, option=orjson.OPT_INDENT_2).decode())
+                    except orjson.JSONDecodeError:
                         # Not JSON, log as text if possible
                         try:
                             text_content = content.decode('utf-8')
                             # Log only first 1000 chars to avoid flooding logs
                             if len(text_content) > 1000:
                                 text_content = text_content[:1000] + "... [truncated]"
-                            logger.debug(f"[{request_id}] Response content (text): {text_content}")
+                            logger.debug("[%s] Response content (text): %s", request_id, text_content)
                         except UnicodeDecodeError:
-                            logger.debug(f"[{request_id}] Response content is binary data (not logged)")
+                            logger.debug("[%s] Response content is binary data (not logged)", request_id)
                 except Exception as e:
-                    logger.debug(f"[{request_id}] Error while logging response content: {str(e)}")
+                    logger.debug("[%s] Error while logging response content: %s", request_id, str(e))
         
-        # Process response headers
-        response_headers = dict(response.headers)
+        # Create response with the same status code, dropping the headers that might
+        # interfere with encoding: the content is already decompressed by httpx, so we send it as-is
+        logger.debug("[%s] Sending response back to client with status %s", request_id, response.status_code)
         
-        # Remove problematic headers that might interfere with encoding
-        headers_to_remove = ["content-length", "content-encoding", "transfer-encoding"]
-        for header in headers_to_remove:
-            if header in response_headers:
-                if DEBUG_MODE:
-                    logger.debug(f"[{request_id}] Removing header: {header}")
-                del response_headers[header]
-        
-        # Create response with the same status code and modified headers
-        # The content is already decompressed by httpx, so we send it as-is
-        if DEBUG_MODE:
-            logger.debug(f"[{request_id}] Sending response back to client with status {response.status_code}")
-            
-        return Response(
-            content=content,
-            status_code=response.status_code,
-            headers=response_headers,
-        )
+        buffered_response = Response(content=content, status_code=response.status_code)
+        buffered_response.raw_headers.extend(filter_headers(response.headers.raw, _HOP_HEADERS))
+        return buffered_response
     except Exception as e:
         elapsed = time.time() - start_time
         logger.error(f"[{request_id}] Error forwarding request after {elapsed:.3f}s: {str(e)}")
@@ -350,25 +433,27 @@ async def handle_request(request: Request, path: str, request_id: str, span: Opt
             span.set_attribute("error", True)
             span.set_attribute("error.message", str(e))
         
-        if DEBUG_MODE:
-            logger.debug(f"[{request_id}] Error details:\n{traceback.format_exc()}")
+        if debug:
+            logger.debug("[%s] Error details:\n%s", request_id, traceback.format_exc())
         return Response(content=str(e), status_code=500)
     finally:
-        await client.aclose()
-        if DEBUG_MODE:
+        if debug:
             total_elapsed = time.time() - start_time
-            logger.debug(f"[{request_id}] Request completed in {total_elapsed:.3f}s")
+            logger.debug("[%s] Request completed in %.3fs", request_id, total_elapsed)
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    if DEBUG_MODE:
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
         logger.debug("Health check requested")
     return {"status": "ok"}
 
 
 # Instrumenta l'app FastAPI con OpenTelemetry se il tracing è abilitato
 if JAEGER_ENABLED:
-    FastAPIInstrumentor.instrument_app(app)
+    # Ogni voce di excluded_urls e' una regex cercata nell'URL completo: solo la probe /health
+    # viene esclusa, senza perdere gli span delle URL Citrix che contengono "health" o "metrics"
+    FastAPIInstrumentor.instrument_app(app, excluded_urls=r"^https?://[^/]+/health$")
     logger.info("FastAPI instrumented with OpenTelemetry")
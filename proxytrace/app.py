@@ -6,23 +6,38 @@ import time
 import os
 import logging
 import orjson
+import gzip
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from requests import Session
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 import pybreaker
 from prometheus_client import start_http_server, Counter, Gauge, Summary
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from influxdb_client import InfluxDBClient, WriteOptions
+
+try:
+    from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+    from opentelemetry.proto.trace.v1.trace_pb2 import Span as ProtoSpan
+except ImportError:
+    ExportTraceServiceRequest = None
 
 # ---------------------- Configuration ----------------------
 LISTEN_HOST = os.getenv('LISTEN_HOST', '0.0.0.0')
 LISTEN_PORT = int(os.getenv('LISTEN_PORT', 5000))
 METRICS_PORT = int(os.getenv('METRICS_PORT', 8000))
 OTLP_ENDPOINT = os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://jaeger:4318/v1/traces')
+OTLP_PROTOCOL = os.getenv('OTEL_EXPORTER_OTLP_PROTOCOL', 'http/protobuf')  # 'http/protobuf' or 'http/json'
+OTLP_COMPRESSION = os.getenv('OTEL_EXPORTER_OTLP_COMPRESSION', 'gzip')  # 'gzip' or 'none'
 WORKER_COUNT = int(os.getenv('WORKER_COUNT', 8))
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', 200))
 BATCH_TIMEOUT = float(os.getenv('BATCH_TIMEOUT', 0.2))  # seconds
 QUEUE_MAXSIZE = int(os.getenv('QUEUE_MAXSIZE', 10000))
+PARSE_CHUNK_SIZE = int(os.getenv('PARSE_CHUNK_SIZE', 100))  # lines per task sent to the parse processes
+# One span queue and BatchExporter per shard; with few workers a single exporter keeps the batches full
+EXPORTER_COUNT = int(os.getenv('EXPORTER_COUNT', 1 if WORKER_COUNT <= 2 else min(WORKER_COUNT, 4)))
 DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() in ('true', '1', 'yes')
 
 # InfluxDB config
@@ -39,6 +54,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.info(f"Debug mode: {'enabled' if DEBUG_MODE else 'disabled'}")
 
+if OTLP_PROTOCOL == 'http/protobuf' and ExportTraceServiceRequest is None:
+    logger.warning("opentelemetry-proto not installed, exporting spans as OTLP/JSON")
+    OTLP_PROTOCOL = 'http/json'
+logger.info(f"OTLP protocol: {OTLP_PROTOCOL}")
+
 # ---------------------- Metrics ----------------------
 records_received = Counter('records_received_total', 'Total records received')
 records_parsed = Counter('records_parsed_total', 'Total records parsed into spans')
@@ -48,98 +68,232 @@ span_queue_size = Gauge('span_queue_size', 'Current size of the span queue')
 batch_latency = Summary('batch_latency_seconds', 'Time spent sending batch')
 
 # ---------------------- Queues & Shutdown ----------------------
-recv_queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
-span_queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
+# SimpleQueue is implemented in C and has no condition variables. It is unbounded, so the
+# producers apply the QUEUE_MAXSIZE limit themselves: the socket readers for recv_queue,
+# the workers for the span queues
+# recv_queue holds lists of lines, one per socket read: its limit is in lists, sized so that
+# lists of about PARSE_CHUNK_SIZE lines add up to QUEUE_MAXSIZE lines
+recv_queue = queue.SimpleQueue()
+RECV_QUEUE_MAXSIZE = max(1, QUEUE_MAXSIZE // PARSE_CHUNK_SIZE)
+# Spans are sharded by session GUID, so all the spans of a session go through the same exporter
+span_queues = [queue.SimpleQueue() for _ in range(EXPORTER_COUNT)]
 shutdown_event = threading.Event()
 
 # ---------------------- Circuit Breaker ----------------------
 breaker = pybreaker.CircuitBreaker(fail_max=5, reset_timeout=30)
 
 # ---------------------- HTTP Session with Retry ----------------------
+# TCP keepalive on the exporter connections, so pooled sockets left idle between batches
+# are not silently dropped by firewalls/NAT and re-established on the next send
+KEEPALIVE_SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, 'TCP_KEEPIDLE'):
+    KEEPALIVE_SOCKET_OPTIONS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+    ]
+
+class KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + KEEPALIVE_SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
 session = Session()
 retries = Retry(
     total=3,
     backoff_factor=0.5,
     status_forcelist=[429, 500, 502, 503, 504]
 )
-adapter = HTTPAdapter(max_retries=retries, pool_connections=10, pool_maxsize=10)
+# At least one pooled connection per exporter thread, so concurrent sends never find the pool full
+adapter = KeepAliveAdapter(max_retries=retries, pool_connections=10, pool_maxsize=max(10, EXPORTER_COUNT))
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
+OTLP_HEADERS = {
+    'Content-Type': 'application/x-protobuf' if OTLP_PROTOCOL == 'http/protobuf' else 'application/json'
+}
+if OTLP_COMPRESSION == 'gzip':
+    OTLP_HEADERS['Content-Encoding'] = 'gzip'
+
 # ---------------------- InfluxDB Client ----------------------
 influx_client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
 write_api = influx_client.write_api(write_options=WriteOptions(batch_size=1000, flush_interval=1000))
 
+# The guid->trace_id mappings are written as line protocol strings instead of Point objects:
+# measurement by trace type (logon trace ids start with '1'), escapes for the tag values.
+# Backslashes are escaped too (Point leaves them as they are), so a value ending in '\'
+# cannot swallow the separator that follows it
+_TRACE_MAP_MEASUREMENTS = {True: 'uberAgent:logonTraceMap', False: 'uberAgent:logoffTraceMap'}
+_TAG_ESCAPES = str.maketrans({'\\': '\\\\', ',': r'\,', '=': r'\=', ' ': r'\ ',
+                              '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+
+
+def trace_map_lines(mappings, ts):
+    """Line protocol for the guid->trace_id mappings, one line per mapping, at timestamp ts (ns)."""
+    return "\n".join([
+        f"{_TRACE_MAP_MEASUREMENTS[t[0] == '1']},guid={g.translate(_TAG_ESCAPES)},"
+        f"trace_id={t.translate(_TAG_ESCAPES)} value=0i {ts}"
+        for g, t in mappings.items()
+    ])
+
 # ---------------------- Span Builder ----------------------
-def build_span(record: dict) -> dict:
-    epoch_s = int(time.time())
-    start_ns = epoch_s * 1_000_000_000 + int(record.get('ProcStartTimeRelativeMs', 0)) * 1_000_000
-    end_ns = start_ns + int(record.get('ProcLifetimeMs', 0)) * 1_000_000
-
-    span_id = format(int(record.get('ProcID', 0)), '016x')
-    parent_id = ''
-    if int(record.get('ProcParentID', 0)):
-        parent_id = format(int(record.get('ProcParentID', 0)), '016x')
+# Each span is serialized once, in the parse processes, into a fragment of the export request
+# body, so the exporter only has to concatenate them:
+# - http/protobuf: an ExportTraceServiceRequest holding the span's resourceSpan; serialized
+#   messages of the same type concatenate into one message with the repeated fields merged
+# - http/json: the resourceSpan object, built from precomputed fragments for the constant
+#   parts of the document and orjson.dumps for the varying values
+_dumps = orjson.dumps
+
+def _identity(value):
+    return value
+
+def _attribute_prefix(key, value_type):
+    return b'{"key":' + _dumps(key) + b',"value":{"' + value_type.encode() + b'":'
+
+# Span attributes copied from the record: (key, OTLP/JSON value type, conversion, default)
+_ATTRIBUTE_SPECS = (
+    ('ProcUser', 'stringValue', _identity, 'unknown-user'),
+    ('ProcCPUTimeMs', 'intValue', int, 0),
+    ('ProcWorkingSetMB', 'doubleValue', float, 0),
+    ('ProcNetKBPS', 'doubleValue', float, 0),
+    ('ProcIOReadCount', 'intValue', int, 0),
+    ('ProcIOWriteCount', 'intValue', int, 0),
+    ('ProcIOReadMB', 'doubleValue', int, 0),
+    ('ProcIOWriteMB', 'doubleValue', int, 0),
+    ('ProcIOLatencyReadMs2', 'intValue', int, 0),
+    ('ProcIOLatencyWriteMs2', 'intValue', int, 0),
+    ('ProcLifetimeMs', 'intValue', int, 0),
+)
+
+# JSON: (prefix, conversion, key, default)
+_SPAN_ATTRIBUTES = tuple(
+    (_attribute_prefix(key, value_type), convert, key, default)
+    for key, value_type, convert, default in _ATTRIBUTE_SPECS
+)
+
+# Protobuf: (AnyValue field, conversion, key, default)
+_PROTO_VALUE_FIELDS = {'stringValue': 'string_value', 'intValue': 'int_value', 'doubleValue': 'double_value'}
+_PROTO_SPAN_ATTRIBUTES = tuple(
+    (_PROTO_VALUE_FIELDS[value_type], convert, key, default)
+    for key, value_type, convert, default in _ATTRIBUTE_SPECS
+)
+
+_EVENT_TYPE_ATTRIBUTES = {
+    event_type: _attribute_prefix('event_type', 'stringValue') + _dumps(event_type) + b'}}'
+    for event_type in ('logon', 'logoff')
+}
+
+_RESOURCE_SPAN_START = b'{"resource":{"attributes":[{"key":"service.name","value":{"stringValue":'
+_SCOPE_SPANS_START = b'}}]},"scopeSpans":[{"spans":[{"traceId":'
+_RESOURCE_SPAN_END = b']}]}]}'
+
+def _serialize_json(record, service_name, trace_id, span_id, parent_pid, start_ns, end_ns, event_type):
+    """Serialize a span as an OTLP/JSON resourceSpan object."""
+    get = record.get
+    parent_id = f'{parent_pid:016x}' if parent_pid else ''
+    parts = [
+        _RESOURCE_SPAN_START, _dumps(service_name),
+        _SCOPE_SPANS_START, _dumps(trace_id),
+        b',"spanId":"', f'{span_id:016x}'.encode(),
+        b'","parentSpanId":"', parent_id.encode(),
+        b'","name":', _dumps(get('ProcName', 'unknown-span')),
+        b',"kind":"SPAN_KIND_INTERNAL","startTimeUnixNano":"', str(start_ns).encode(),
+        b'","endTimeUnixNano":"', str(end_ns).encode(),
+        b'","attributes":[',
+    ]
+    for prefix, convert, key, default in _SPAN_ATTRIBUTES:
+        parts.append(prefix)
+        parts.append(_dumps(convert(get(key, default))))
+        parts.append(b'}},')
+    parts.append(_EVENT_TYPE_ATTRIBUTES[event_type])
+    parts.append(_RESOURCE_SPAN_END)
+    return b''.join(parts)
+
+def _protobuf_template():
+    """
+    Build the ExportTraceServiceRequest skeleton shared by all the spans: the resource,
+    scope and span messages and every attribute key are created once, build_span only
+    copies it and fills in the values.
+    """
+    request = ExportTraceServiceRequest()
+    resource_spans = request.resource_spans.add()
+    resource_spans.resource.attributes.add(key='service.name')
+    span = resource_spans.scope_spans.add().spans.add(kind=ProtoSpan.SPAN_KIND_INTERNAL)
+    for _, _, key, _ in _PROTO_SPAN_ATTRIBUTES:
+        span.attributes.add(key=key)
+    span.attributes.add(key='event_type')
+    return request
+
+_PROTO_TEMPLATE = _protobuf_template() if ExportTraceServiceRequest is not None else None
+
+def _serialize_protobuf(record, service_name, trace_id, span_id, parent_pid, start_ns, end_ns, event_type):
+    """Serialize a span as an OTLP ExportTraceServiceRequest with a single resourceSpan."""
+    get = record.get
+    request = ExportTraceServiceRequest()
+    request.CopyFrom(_PROTO_TEMPLATE)
+    resource_spans = request.resource_spans[0]
+    resource_spans.resource.attributes[0].value.string_value = service_name
+    span = resource_spans.scope_spans[0].spans[0]
+    span.trace_id = bytes.fromhex(trace_id)
+    span.span_id = span_id.to_bytes(8, 'big')
+    if parent_pid:
+        span.parent_span_id = parent_pid.to_bytes(8, 'big')
+    span.name = get('ProcName', 'unknown-span')
+    span.start_time_unix_nano = start_ns
+    span.end_time_unix_nano = end_ns
+    attributes = span.attributes
+    for attribute, (value_field, convert, key, default) in zip(attributes, _PROTO_SPAN_ATTRIBUTES):
+        setattr(attribute.value, value_field, convert(get(key, default)))
+    attributes[-1].value.string_value = event_type
+    return request.SerializeToString()
+
+_serialize_span = _serialize_protobuf if OTLP_PROTOCOL == 'http/protobuf' else _serialize_json
+
+def build_span(record: dict, epoch_ns: int) -> dict:
+    """
+    Convert a record into a span. The returned dict holds the session GUID and trace id,
+    used for the Influx mapping, and '_payload', the span serialized for OTLP_PROTOCOL.
+    epoch_ns is the current time truncated to the second, shared by a chunk of records.
+    """
+    # Each field is read from the record once, through a bound get
+    get = record.get
+    start_ns = epoch_ns + int(get('ProcStartTimeRelativeMs', 0)) * 1_000_000
+    end_ns = start_ns + int(get('ProcLifetimeMs', 0)) * 1_000_000
+
+    span_id = int(get('ProcID', 0))
+    parent_pid = int(get('ProcParentID', 0))
     
     is_logoff = 'LogoffProcType' in record
-    service_name = record.get('LogoffProcType', record.get('LogonProcType', 'unknown-service')) if is_logoff else record.get('LogonProcType', 'unknown-service')
-    event_type = "logoff" if is_logoff else "logon"
-    guid = record.get('SessionGUID', '')
-    base_trace = guid.replace('-', '')
     if is_logoff:
-        trace_id = ('2' + base_trace + '0'*31)[:32]
+        service_name = record['LogoffProcType']
+        event_type = "logoff"
     else:
-        trace_id = ('1' + base_trace + '0'*31)[:32]
+        service_name = get('LogonProcType', 'unknown-service')
+        event_type = "logon"
+    guid = get('SessionGUID', '')
+    # 32 hex digits: the event prefix and the GUID, zero padded on the right
+    trace_id = (('2' if is_logoff else '1') + guid.replace('-', '')).ljust(32, '0')[:32]
 
     return {
         '_guid': guid,
         '_trace_id': trace_id,
-        'resourceSpans': [
-            {
-                'resource': {
-                    'attributes': [
-                        {'key': 'service.name', 'value': {'stringValue': service_name}}
-                    ]
-                },
-                'scopeSpans': [
-                    {
-                        'spans': [
-                            {
-                                'traceId': trace_id,
-                                'spanId': span_id,
-                                'parentSpanId': parent_id,
-                                'name': record.get('ProcName', 'unknown-span'),
-                                'kind': 'SPAN_KIND_INTERNAL',
-                                'startTimeUnixNano': str(start_ns),
-                                'endTimeUnixNano': str(end_ns),
-                                'attributes': [
-                                    {'key': 'ProcUser', 'value': {'stringValue': record.get('ProcUser', 'unknown-user')}},
-                                    {'key': 'ProcCPUTimeMs', 'value': {'intValue': int(record.get('ProcCPUTimeMs', 0))}},
-                                    {'key': 'ProcWorkingSetMB', 'value': {'doubleValue': float(record.get('ProcWorkingSetMB', 0))}},
-                                    {'key': 'ProcNetKBPS', 'value': {'doubleValue': float(record.get('ProcNetKBPS', 0))}},
-                                    {'key': 'ProcIOReadCount', 'value': {'intValue': int(record.get('ProcIOReadCount', 0))}},
-                                    {'key': 'ProcIOWriteCount', 'value': {'intValue': int(record.get('ProcIOWriteCount', 0))}},
-                                    {'key': 'ProcIOReadMB', 'value': {'doubleValue': int(record.get('ProcIOReadMB', 0))}},
-                                    {'key': 'ProcIOWriteMB', 'value': {'doubleValue': int(record.get('ProcIOWriteMB', 0))}},
-                                    {'key': 'ProcIOLatencyReadMs2', 'value': {'intValue': int(record.get('ProcIOLatencyReadMs2', 0))}},
-                                    {'key': 'ProcIOLatencyWriteMs2', 'value': {'intValue': int(record.get('ProcIOLatencyWriteMs2', 0))}},
-                                    {'key': 'ProcLifetimeMs', 'value': {'intValue': int(record.get('ProcLifetimeMs', 0))}},
-                                    {'key': 'event_type', 'value': {'stringValue': event_type}}
-                                ]
-                            }
-                        ]
-                    }
-                ]
-            }
-        ]
+        '_payload': _serialize_span(record, service_name, trace_id, span_id, parent_pid, start_ns, end_ns, event_type)
     }
 
+# Build the export request body from the serialized spans
+def _encode_json_batch(payloads):
+    return b'{"resourceSpans":[' + b','.join(payloads) + b']}'
+
+encode_batch = b''.join if OTLP_PROTOCOL == 'http/protobuf' else _encode_json_batch
+
 # ---------------------- Batch Exporter ----------------------
 class BatchExporter(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
+    def __init__(self, shard):
+        super().__init__(daemon=True, name=f"BatchExporter-{shard}")
+        self.span_queue = span_queues[shard]
         if DEBUG_MODE:
-            logger.debug("BatchExporter initialized in debug mode")
+            logger.debug(f"BatchExporter {shard} initialized in debug mode")
 
     @breaker
     @retry(
@@ -152,14 +306,16 @@ class BatchExporter(threading.Thread):
         if DEBUG_MODE:
             logger.debug(f"Sending batch of {len(batch)} spans to OTLP endpoint")
         
-        payload = {'resourceSpans': []}
-        for span in batch:
-            payload['resourceSpans'].extend(span['resourceSpans'])
+        # The spans are already serialized: the payload is just their concatenation
+        body = encode_batch([span['_payload'] for span in batch])
+        if OTLP_COMPRESSION == 'gzip':
+            # Lowest level: most of the size reduction for a fraction of the CPU of the default level
+            body = gzip.compress(body, compresslevel=1)
 
         if DEBUG_MODE:
-            logger.debug(f"Batch payload contains {len(payload['resourceSpans'])} resourceSpans")
+            logger.debug(f"Batch payload contains {len(batch)} resourceSpans ({len(body)} bytes, {OTLP_PROTOCOL})")
         
-        resp = session.post(OTLP_ENDPOINT, json=payload, timeout=5)
+        resp = session.post(OTLP_ENDPOINT, data=body, headers=OTLP_HEADERS, timeout=5)
         resp.raise_for_status()
         
         if DEBUG_MODE:
@@ -168,7 +324,8 @@ class BatchExporter(threading.Thread):
         return resp
 
     def run(self):
-        logger.info("BatchExporter thread started")
+        logger.info(f"{self.name} thread started")
+        span_queue = self.span_queue
         while not shutdown_event.is_set():
             batch = []
             try:
@@ -204,55 +361,102 @@ class BatchExporter(threading.Thread):
                     if DEBUG_MODE:
                         logger.debug(f"Writing {len(seen)} unique guid->trace_id mappings to InfluxDB")
                         
-                    for g, t in seen.items():
-                        metric_name = "uberAgent:logonTraceMap" if t.startswith('1') else "uberAgent:logoffTraceMap"
-                        p = Point(metric_name).tag("guid", g).tag("trace_id", t).field("value", 0).time(ts)
-                        write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=p)
-                        
-                        if DEBUG_MODE:
-                            logger.debug(f"Metric written: {metric_name}, GUID: {g}, Trace ID: {t}, Timestamp: {ts}")
-                        
-                        if DEBUG_MODE:
-                            logger.debug(f"Wrote mapping for GUID {g} -> trace_id {t}")
+                    # One write call for all the mappings of the batch, as a single line protocol
+                    # string: the batching write api queues it as one item instead of one per line
+                    write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=trace_map_lines(seen, ts))
+                    
+                    if DEBUG_MODE:
+                        for g, t in seen.items():
+                            logger.debug(f"Wrote mapping for GUID {g} -> trace_id {t}, Timestamp: {ts}")
                 except Exception as e:
                     logger.error(f"Batch export failed: {e}")
                     if DEBUG_MODE:
                         logger.exception("Detailed export error")
                     export_failures.inc()
-            span_queue_size.set(span_queue.qsize())
 
 # ---------------------- Worker ----------------------
-def worker():
+def span_queue_depth():
+    return sum(q.qsize() for q in span_queues)
+
+def queue_metrics_updater(interval=0.5):
+    """Sample the span queue depth for the span_queue_size gauge, outside the hot paths."""
+    while not shutdown_event.wait(interval):
+        span_queue_size.set(span_queue_depth())
+
+def parse_lines(lines):
+    """
+    Decode a chunk of lines and build their spans. Runs in the parse processes,
+    so it does no logging and touches no metrics: errors are returned to the caller.
+    """
+    spans, errors = [], []
+    # The spans are anchored to the current second: a chunk is parsed well within it
+    epoch_ns = time.time_ns() // 1_000_000_000 * 1_000_000_000
+    for line in lines:
+        try:
+            spans.append(build_span(orjson.loads(line), epoch_ns))
+        except Exception as e:
+            errors.append(str(e))
+    return spans, errors
+
+def worker(executor):
     while not shutdown_event.is_set():
         try:
-            line = recv_queue.get(timeout=1)
+            lines = recv_queue.get(timeout=1)
         except queue.Empty:
             continue
+        # Take what is already queued too, so each round-trip to the process pool carries a chunk
+        try:
+            while len(lines) < PARSE_CHUNK_SIZE:
+                lines += recv_queue.get_nowait()
+        except queue.Empty:
+            pass
 
-        records_received.inc()
+        records_received.inc(len(lines))
         try:
-            record = orjson.loads(line)
-            span = build_span(record)
-            records_parsed.inc()
-            span_queue.put(span)
+            spans, errors = executor.submit(parse_lines, lines).result()
         except Exception as e:
-            logger.error(f"Failed to parse record: {e}")
-        span_queue_size.set(span_queue.qsize())
+            logger.error(f"Failed to parse records: {e}")
+            continue
+        for error in errors:
+            logger.error(f"Failed to parse record: {error}")
+        records_parsed.inc(len(spans))
+        # Backpressure: wait for the exporters before queueing more spans
+        while span_queue_depth() >= QUEUE_MAXSIZE and not shutdown_event.is_set():
+            time.sleep(0.01)
+        for span in spans:
+            span_queues[hash(span['_guid']) % EXPORTER_COUNT].put(span)
 
 # ---------------------- Socket Reader ----------------------
 def handle_client(sock, addr):
     logger.info(f"Connection from {addr}")
-    buf = b''
+    # bytearray consumed in place: each line costs O(line length), not a copy of the whole buffer
+    buf = bytearray()
     try:
         while not shutdown_event.is_set():
-            data = sock.recv(4096)
+            data = sock.recv(65536)
             if not data:
                 break
+            # Only the new data can contain the next newline
+            start = len(buf)
             buf += data
-            while b'\n' in buf:
-                line, buf = buf.split(b'\n', 1)
+            i = buf.find(b'\n', start)
+            if i == -1:
+                continue
+            pos = 0
+            lines = []
+            while i != -1:
+                line = bytes(buf[pos:i])
                 if line.strip():
-                    recv_queue.put(line)
+                    lines.append(line)
+                pos = i + 1
+                i = buf.find(b'\n', pos)
+            del buf[:pos]
+            # One put for all the lines of this read
+            if lines:
+                recv_queue.put(lines)
+            # Backpressure: stop reading from the socket while the workers catch up
+            while recv_queue.qsize() >= RECV_QUEUE_MAXSIZE and not shutdown_event.is_set():
+                time.sleep(0.01)
     except Exception as e:
         logger.error(f"Client error {addr}: {e}")
     finally:
@@ -284,19 +488,30 @@ signal.signal(signal.SIGTERM, shutdown)
 
 # ---------------------- Main ----------------------
 if __name__ == '__main__':
+    # JSON decoding and span building are CPU bound: they run in WORKER_COUNT processes,
+    # fed by as many threads. The pool is started first, so the processes are forked
+    # before the metrics, exporter and worker threads are running. The fork start method
+    # is explicit: the children inherit the configuration and the span templates instead
+    # of re-importing this module, and all of them are started by the first submit
+    executor = ProcessPoolExecutor(max_workers=WORKER_COUNT, mp_context=multiprocessing.get_context('fork'))
+    executor.submit(parse_lines, []).result()
+
     start_http_server(METRICS_PORT)
     logger.info(f"Metrics HTTP server running on :{METRICS_PORT}")
 
-    exporter = BatchExporter()
-    exporter.start()
+    threading.Thread(target=queue_metrics_updater, daemon=True).start()
+
+    for shard in range(EXPORTER_COUNT):
+        BatchExporter(shard).start()
 
     for _ in range(WORKER_COUNT):
-        t = threading.Thread(target=worker, daemon=True)
+        t = threading.Thread(target=worker, args=(executor,), daemon=True)
         t.start()
 
     socket_listener()
 
     logger.info("Waiting for queues to drain...")
-    while not recv_queue.empty() or not span_queue.empty():
+    while not recv_queue.empty() or span_queue_depth():
         time.sleep(1)
+    executor.shutdown()
     logger.info("Shutdown complete")
@@ -0,0 +1,40 @@
+import pytest
+from influxdb_client import Point
+
+from app import trace_map_lines
+
+TS = 1700000000000000000
+
+
+def _point_line(guid, trace_id):
+    # Point does not escape backslashes in tag values: doubling them beforehand gives the
+    # line expected from trace_map_lines, which escapes them
+    measurement = 'uberAgent:logonTraceMap' if trace_id[0] == '1' else 'uberAgent:logoffTraceMap'
+    return (Point(measurement)
+            .tag('guid', guid.replace('\\', '\\\\'))
+            .tag('trace_id', trace_id.replace('\\', '\\\\'))
+            .field('value', 0)
+            .time(TS)
+            .to_line_protocol())
+
+
+@pytest.mark.parametrize('guid, trace_id', [
+    ('3f2504e0-4f89-11d3-9a0c-0305e82c3301', '13f2504e04f8911d39a0c0305e82c330'),
+    ('with space', '2logoff trace'),
+    ('a,b=c', '1x=y,z'),
+    ('back\\slash', '1has\\inside'),
+    ('\\,\\=\\ x', '2\\\\x'),
+])
+def test_trace_map_lines_matches_point(guid, trace_id):
+    assert trace_map_lines({guid: trace_id}, TS) == _point_line(guid, trace_id)
+
+
+def test_trace_map_lines_escapes_backslash_before_separator():
+    # Point pads a value ending in a backslash with a space instead of escaping it
+    line = trace_map_lines({'guid\\': '1trace'}, TS)
+    assert line == f'uberAgent:logonTraceMap,guid=guid\\\\,trace_id=1trace value=0i {TS}'
+
+
+def test_trace_map_lines_one_line_per_mapping():
+    lines = trace_map_lines({'a': '1t', 'b': '2t'}, TS).split('\n')
+    assert [line.split(',')[0] for line in lines] == ['uberAgent:logonTraceMap', 'uberAgent:logoffTraceMap']
@@ -1,48 +1,139 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from typing import Optional
+import json
+from fastapi import APIRouter, HTTPException, Query, Path, Depends, Header, Response
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 from datetime import datetime
+from pydantic import TypeAdapter
 
-from app.models.models import SessionRequest, SessionResponse
+from app.models.models import SessionRequest, SessionResponse, SessionResponseColumnar, SessionEvent, SESSION_GUID_PATTERN, epoch_ms
 from app.api.victoria_service import victoria_metrics_service
 from app.utils.config import logger
 
 router = APIRouter()
 
-@router.get("/session/{session_guid}")
+# Media type con cui il client richiede la risposta in formato colonnare
+COLUMNAR_MEDIA_TYPE = "application/vnd.session+columnar"
+
+# Schema documentato per le route delle sessioni: senza response_model FastAPI non prepara
+# la validazione della risposta, che arriva gia' serializzata da _session_response
+SESSION_RESPONSES: Dict[Union[int, str], Dict[str, Any]] = {200: {"model": SessionResponse}}
+
+# Eventi serializzati in ogni blocco della risposta in streaming
+STREAM_CHUNK_EVENTS = 100
+
+# Serializzatori creati una volta e riusati da tutte le richieste: producono direttamente
+# bytes, senza la stringa intermedia di model_dump_json da ricodificare in UTF-8
+_dump_response = TypeAdapter(SessionResponse).dump_json
+_dump_columnar = TypeAdapter(SessionResponseColumnar).dump_json
+_dump_event = TypeAdapter(SessionEvent).dump_json
+
+def _range_ms(start_ms: Optional[int], end_ms: Optional[int],
+              start_date: Optional[datetime], end_date: Optional[datetime]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Restituisce l'intervallo in millisecondi Unix, usando le date ISO solo
+    quando i millisecondi non sono indicati.
+    
+    Args:
+        start_ms: Inizio in millisecondi Unix
+        end_ms: Fine in millisecondi Unix
+        start_date: Data di inizio (formato ISO)
+        end_date: Data di fine (formato ISO)
+    
+    Returns:
+        Tuple[Optional[int], Optional[int]]: Inizio e fine in millisecondi
+    """
+    if start_ms is None:
+        start_ms = epoch_ms(start_date)
+    if end_ms is None:
+        end_ms = epoch_ms(end_date)
+    return start_ms, end_ms
+
+def _check_range(start_ms: Optional[int], end_ms: Optional[int]) -> None:
+    """
+    Rifiuta con 400 un intervallo con l'inizio dopo la fine, senza interrogare VictoriaMetrics.
+    
+    Args:
+        start_ms: Inizio in millisecondi Unix
+        end_ms: Fine in millisecondi Unix
+    """
+    if start_ms is not None and end_ms is not None and start_ms > end_ms:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervallo non valido: l'inizio ({start_ms}) e' successivo alla fine ({end_ms})"
+        )
+
+def _session_response(session_guid: str, events: List[SessionEvent], metadata: Dict[str, Any],
+                      accept: Optional[str]) -> Response:
+    """
+    Prepara la risposta, in formato colonnare se richiesto dall'header Accept.
+    Il JSON viene serializzato in un solo passaggio (pydantic-core), senza la
+    conversione di FastAPI tramite jsonable_encoder. Le route non hanno response_model:
+    SessionResponse compare solo nello schema OpenAPI (SESSION_RESPONSES).
+    
+    Args:
+        session_guid: GUID della sessione interrogata
+        events: Eventi della sessione
+        metadata: Metadati della risposta
+        accept: Valore dell'header Accept della richiesta
+    
+    Returns:
+        Response: Risposta JSON
+    """
+    if accept and COLUMNAR_MEDIA_TYPE in accept:
+        # Una lista per campo invece di un oggetto per evento
+        model = SessionResponseColumnar.model_construct(
+            session_guid=session_guid,
+            times=[event.time for event in events],
+            session_changes=[event.session_changes for event in events],
+            client_names=[event.client_name for event in events],
+            client_ips=[event.client_ip for event in events],
+            client_platforms=[event.client_platform for event in events],
+            client_versions=[event.client_version for event in events],
+            connection_states=[event.connection_state for event in events],
+            metadata=metadata
+        )
+        return Response(content=_dump_columnar(model), media_type=COLUMNAR_MEDIA_TYPE)
+    
+    model = SessionResponse(session_guid=session_guid, events=events, metadata=metadata)
+    return Response(content=_dump_response(model), media_type="application/json")
+
+@router.get("/session/{session_guid}", response_model=None, responses=SESSION_RESPONSES)
 async def get_session_events(
-    session_guid: str,
-    start_date: Optional[datetime] = Query(None, description="Data di inizio (formato ISO)"),
-    end_date: Optional[datetime] = Query(None, description="Data di fine (formato ISO)")
+    session_guid: str = Path(..., pattern=SESSION_GUID_PATTERN, description="GUID della sessione da interrogare"),
+    start_ms: Optional[int] = Query(None, ge=0, description="Inizio in millisecondi Unix"),
+    end_ms: Optional[int] = Query(None, ge=0, description="Fine in millisecondi Unix"),
+    start_date: Optional[datetime] = Query(None, description="Data di inizio (formato ISO), in alternativa a start_ms"),
+    end_date: Optional[datetime] = Query(None, description="Data di fine (formato ISO), in alternativa a end_ms"),
+    accept: Optional[str] = Header(None)
 ):
     """
     Recupera gli eventi di una sessione tramite il suo GUID.
     
     Args:
         session_guid: GUID della sessione da interrogare
-        start_date: Data di inizio opzionale (formato ISO)
-        end_date: Data di fine opzionale (formato ISO)
+        start_ms: Inizio opzionale in millisecondi Unix
+        end_ms: Fine opzionale in millisecondi Unix
+        start_date: Data di inizio opzionale (formato ISO), usata se manca start_ms
+        end_date: Data di fine opzionale (formato ISO), usata se manca end_ms
+        accept: Con application/vnd.session+columnar gli eventi vengono restituiti per colonne
     
     Returns:
         SessionResponse: Dati della sessione e relativi eventi
     """
-    logger.info(f"Richiesta dati per la sessione {session_guid} dal {start_date} al {end_date}")
+    start_ms, end_ms = _range_ms(start_ms, end_ms, start_date, end_date)
+    _check_range(start_ms, end_ms)
+    logger.info(f"Richiesta dati per la sessione {session_guid} da {start_ms} a {end_ms} ms")
     
     try:
         # Recupera i dati dalla sessione tramite VictoriaMetrics
-        events = await victoria_metrics_service.get_session_data(session_guid, start_date, end_date)
+        events = await victoria_metrics_service.get_session_data(session_guid, start_ms, end_ms)
         
         # Prepara la risposta
-        response = SessionResponse(
-            session_guid=session_guid,
-            events=events,
-            metadata={
-                "start_date": start_date.isoformat() if start_date else None,
-                "end_date": end_date.isoformat() if end_date else None,
-                "total_events": len(events)
-            }
-        )
-        
-        return response
+        return _session_response(session_guid, events, {
+            "start_ms": start_ms,
+            "end_ms": end_ms,
+            "total_events": len(events)
+        }, accept)
         
     except Exception as e:
         logger.error(f"Errore durante l'elaborazione della richiesta per la sessione {session_guid}: {str(e)}")
@@ -51,43 +142,93 @@ async def get_session_events(
             detail=f"Errore durante l'elaborazione della richiesta: {str(e)}"
         )
 
-@router.post("/session")
-async def post_session_events(request: SessionRequest):
+@router.post("/session", response_model=None, responses=SESSION_RESPONSES)
+async def post_session_events(request: SessionRequest, accept: Optional[str] = Header(None)):
     """
     Recupera gli eventi di una sessione tramite richiesta POST.
     
     Args:
         request: Richiesta con GUID della sessione e date opzionali
+        accept: Con application/vnd.session+columnar gli eventi vengono restituiti per colonne
     
     Returns:
         SessionResponse: Dati della sessione e relativi eventi
     """
     logger.info(f"Richiesta POST dati per la sessione {request.session_guid}")
+    _check_range(request.start_ms, request.end_ms)
     
     try:
         # Recupera i dati dalla sessione tramite VictoriaMetrics
         events = await victoria_metrics_service.get_session_data(
             request.session_guid,
-            request.start_date,
-            request.end_date
+            request.start_ms,
+            request.end_ms
         )
         
         # Prepara la risposta
-        response = SessionResponse(
-            session_guid=request.session_guid,
-            events=events,
-            metadata={
-                "start_date": request.start_date.isoformat() if request.start_date else None,
-                "end_date": request.end_date.isoformat() if request.end_date else None,
-                "total_events": len(events)
-            }
+        return _session_response(request.session_guid, events, {
+            "start_ms": request.start_ms,
+            "end_ms": request.end_ms,
+            "total_events": len(events)
+        }, accept)
+        
+    except Exception as e:
+        logger.error(f"Errore durante l'elaborazione della richiesta POST per la sessione {request.session_guid}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore durante l'elaborazione della richiesta: {str(e)}"
         )
+
+async def _stream_events(events: List[SessionEvent], metadata: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """
+    Serializza gli eventi come Server-Sent Events, un blocco di STREAM_CHUNK_EVENTS
+    eventi alla volta, seguiti da un evento "end" con i metadati.
+    """
+    for start in range(0, len(events), STREAM_CHUNK_EVENTS):
+        yield b"".join([b"data: " + _dump_event(event) + b"\n\n" for event in events[start:start + STREAM_CHUNK_EVENTS]])
+    yield f"event: end\ndata: {json.dumps(metadata)}\n\n".encode()
+
+@router.get("/session/{session_guid}/stream")
+async def stream_session_events(
+    session_guid: str = Path(..., pattern=SESSION_GUID_PATTERN, description="GUID della sessione da interrogare"),
+    start_ms: Optional[int] = Query(None, ge=0, description="Inizio in millisecondi Unix"),
+    end_ms: Optional[int] = Query(None, ge=0, description="Fine in millisecondi Unix"),
+    start_date: Optional[datetime] = Query(None, description="Data di inizio (formato ISO), in alternativa a start_ms"),
+    end_date: Optional[datetime] = Query(None, description="Data di fine (formato ISO), in alternativa a end_ms")
+):
+    """
+    Recupera gli eventi di una sessione e li invia come Server-Sent Events (text/event-stream),
+    un evento per SessionEvent, senza costruire tutta la risposta in memoria.
+    
+    Args:
+        session_guid: GUID della sessione da interrogare
+        start_ms: Inizio opzionale in millisecondi Unix
+        end_ms: Fine opzionale in millisecondi Unix
+        start_date: Data di inizio opzionale (formato ISO), usata se manca start_ms
+        end_date: Data di fine opzionale (formato ISO), usata se manca end_ms
+    
+    Returns:
+        StreamingResponse: Eventi della sessione, seguiti da un evento "end" con i metadati
+    """
+    start_ms, end_ms = _range_ms(start_ms, end_ms, start_date, end_date)
+    _check_range(start_ms, end_ms)
+    logger.info(f"Richiesta stream per la sessione {session_guid} da {start_ms} a {end_ms} ms")
+    
+    try:
+        # Recupera i dati dalla sessione tramite VictoriaMetrics
+        events = await victoria_metrics_service.get_session_data(session_guid, start_ms, end_ms)
         
-        return response
+        metadata = {
+            "session_guid": session_guid,
+            "start_ms": start_ms,
+            "end_ms": end_ms,
+            "total_events": len(events)
+        }
+        return StreamingResponse(_stream_events(events, metadata), media_type="text/event-stream")
         
     except Exception as e:
-        logger.error(f"Errore durante l'elaborazione della richiesta POST per la sessione {request.session_guid}: {str(e)}")
+        logger.error(f"Errore durante l'elaborazione dello stream per la sessione {session_guid}: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Errore durante l'elaborazione della richiesta: {str(e)}"
-        )
\ No newline at end of file
+        )
@@ -1,12 +1,40 @@
 import asyncio
+import operator
+import sys
+import time
 import httpx
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from dateutil.tz import gettz
+from pydantic import TypeAdapter
+from typing import Dict, Iterator, List, Optional, Any, Tuple
 
 from app.utils.config import CONFIG, logger
 from app.models.models import SessionEvent
 
+# Fuso orario locale, per convertire i timestamp come datetime.fromtimestamp
+_LOCAL_TZ = gettz()
+
+# Intervallo interrogato quando la richiesta non indica l'inizio (24 ore)
+DEFAULT_RANGE_MS = 24 * 60 * 60 * 1000
+
+# Validatore della lista di eventi, compilato una volta: gli eventi vengono preparati come dict
+# e validati tutti insieme, piu' veloce sia di SessionEvent(...) sia di model_construct per evento
+_EVENTS_ADAPTER = TypeAdapter(List[SessionEvent])
+
+# Chiave di ordinamento degli eventi: gli eventi restano SessionEvent fino alla risposta,
+# senza un contenitore intermedio da convertire una seconda volta
+_event_time = operator.attrgetter('time')
+
+# Colonne confrontate tra un minuto e il precedente, con l'etichetta del cambiamento come nella query Splunk
+_CHANGE_COLUMNS = ['clientName', 'clientAddress', 'clientPlatform', 'clientVersion', 'connectionState']
+_CHANGE_LABELS = ['Client name change', 'Client IP change', 'Client platform change',
+                  'Client version change', 'Connection state change']
+
+# Riga dei dati del client, nell'ordine di _CHANGE_COLUMNS: tupla semplice, spacchettata
+# direttamente nella costruzione degli eventi senza accessi per nome
+ClientRow = Tuple[Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]
+
 
 class VictoriaMetricsService:
     """
@@ -14,37 +42,53 @@ class VictoriaMetricsService:
     """
     def __init__(self):
         self.base_url = CONFIG.VICTORIA_METRICS_URL
+        # Client condiviso da tutte le query: le connessioni verso VictoriaMetrics restano
+        # aperte e vengono riutilizzate invece di rifare l'handshake a ogni query
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=10.0
+        )
+    
+    async def aclose(self):
+        """
+        Chiude il client HTTP condiviso e le sue connessioni
+        """
+        await self._client.aclose()
         
-    async def get_session_data(self, session_guid: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[SessionEvent]:
+    async def get_session_data(self, session_guid: str, start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> List[SessionEvent]:
         """
         Recupera dati di sessione da VictoriaMetrics e applica trasformazioni simili a Splunk
         
         Args:
             session_guid: GUID della sessione da interrogare
-            start_date: Data di inizio opzionale (default: 24 ore prima della fine)
-            end_date: Data di fine opzionale (default: ora attuale)
+            start_ms: Inizio opzionale in millisecondi Unix (default: 24 ore prima della fine)
+            end_ms: Fine opzionale in millisecondi Unix (default: ora attuale)
         
         Returns:
             List[SessionEvent]: Lista di eventi della sessione trasformati
         """
-        # Imposta date di default se non fornite
-        if not end_date:
-            end_date = datetime.now()
-        if not start_date:
-            start_date = end_date - timedelta(hours=24)
+        # Imposta l'intervallo di default se non fornito
+        if end_ms is None:
+            end_ms = time.time_ns() // 1_000_000
+        if start_ms is None:
+            start_ms = end_ms - DEFAULT_RANGE_MS
             
-        # Formatta le date per l'API di VictoriaMetrics
-        start_ts = int(start_date.timestamp())
-        end_ts = int(end_date.timestamp())
+        # VictoriaMetrics vuole i timestamp Unix in secondi
+        start_ts = start_ms // 1000
+        end_ts = end_ms // 1000
         
         # Questa è la query che estrae i dati base della sessione
         session_query = f'''
-        citrix_session{{sessionId="{session_guid}"}}[{start_ts}:{end_ts}]
+        citrix_session{{sessionId="{session_guid}"}}
         '''
 
         try:
-            # Esegui la query a VictoriaMetrics
-            raw_data = await self._execute_query(session_query)
+            # Esegui in parallelo la query della sessione e quelle degli eventi di logon/logoff
+            raw_data, logon_events, logoff_events = await asyncio.gather(
+                self._execute_query(session_query, start_ts, end_ts),
+                self._get_logon_events(session_guid, start_ts, end_ts),
+                self._get_logoff_events(session_guid, start_ts, end_ts)
+            )
             
             if not raw_data or not raw_data.get('data', {}).get('result'):
                 logger.warning(f"Nessun dato trovato per la sessione {session_guid}")
@@ -56,13 +100,9 @@ class VictoriaMetricsService:
             # Applica le trasformazioni simili a quelle della query Splunk
             events = self._apply_splunk_like_transformations(df, session_guid)
             
-            # Recupera anche i dati di logon/logoff
-            logon_events = await self._get_logon_events(session_guid, start_ts, end_ts)
-            logoff_events = await self._get_logoff_events(session_guid, start_ts, end_ts)
-            
             # Combina tutti gli eventi in ordine cronologico
             all_events = events + logon_events + logoff_events
-            all_events.sort(key=lambda x: x.time, reverse=True)
+            all_events.sort(key=_event_time, reverse=True)
             
             return all_events
             
@@ -70,35 +110,39 @@ class VictoriaMetricsService:
             logger.error(f"Errore durante l'interrogazione di VictoriaMetrics: {str(e)}")
             return []
     
-    async def _execute_query(self, query: str) -> Dict[str, Any]:
+    async def _execute_query(self, query: str, start_ts: int, end_ts: int) -> Dict[str, Any]:
         """
-        Esegue una query PromQL contro VictoriaMetrics
+        Esegue una query PromQL contro VictoriaMetrics, limitata all'intervallo richiesto
         
         Args:
             query: Query PromQL da eseguire
+            start_ts: Timestamp di inizio in formato Unix
+            end_ts: Timestamp di fine in formato Unix
             
         Returns:
             Dict: Risultato della query
         """
         endpoint = f"{self.base_url}/api/v1/query_range"
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    endpoint,
-                    params={
-                        "query": query,
-                        "step": "60s"  # intervallo di campionamento di un minuto
-                    }
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Errore HTTP durante la query: {e}")
-                return {}
-            except Exception as e:
-                logger.error(f"Errore durante la query: {str(e)}")
-                return {}
+        try:
+            response = await self._client.get(
+                endpoint,
+                params={
+                    "query": query,
+                    # L'intervallo viene filtrato da VictoriaMetrics, non dopo la risposta
+                    "start": start_ts,
+                    "end": end_ts,
+                    "step": "60s"  # intervallo di campionamento di un minuto
+                }
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Errore HTTP durante la query: {e}")
+            return {}
+        except Exception as e:
+            logger.error(f"Errore durante la query: {str(e)}")
+            return {}
     
     def _transform_to_dataframe(self, raw_data: Dict[str, Any]) -> pd.DataFrame:
         """
@@ -113,27 +157,31 @@ class VictoriaMetricsService:
         # Estrai i risultati
         results = raw_data.get('data', {}).get('result', [])
         
-        rows = []
+        # Un DataFrame per serie, costruito per colonne: i timestamp vengono convertiti in
+        # blocco in orari locali senza fuso, i valori vuoti diventano NaN
+        frames = []
         for result in results:
-            metric = result.get('metric', {})
             values = result.get('values', [])
-            
-            for timestamp, value in values:
-                # Crea una riga per ogni punto dati
-                row = {
-                    'time': datetime.fromtimestamp(timestamp),
-                    'value': float(value) if value else None,
-                    **metric  # Aggiungi tutte le etichette delle metriche come colonne
-                }
-                rows.append(row)
+            if not values:
+                continue
+            timestamps, samples = zip(*values)
+            times = pd.to_datetime(np.asarray(timestamps, dtype='f8'), unit='s', utc=True)
+            frames.append(pd.DataFrame({
+                'time': times.tz_convert(_LOCAL_TZ).tz_localize(None),
+                'value': np.array([sample or 'nan' for sample in samples], dtype='f8'),
+                # Le etichette della serie diventano colonne costanti; i valori vengono internati,
+                # cosi' stati, piattaforme e versioni ripetuti tra serie e richieste sono un solo oggetto
+                **{label: sys.intern(value) if isinstance(value, str) else value
+                   for label, value in result.get('metric', {}).items()}
+            }))
         
-        if not rows:
+        if not frames:
             # Restituisci un DataFrame vuoto ma con le colonne necessarie
             return pd.DataFrame(columns=['time', 'value', 'clientName', 'clientAddress',
                                         'clientPlatform', 'clientVersion', 'connectionState'])
         
         # Crea il DataFrame
-        df = pd.DataFrame(rows)
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
         
         # Rinomina le colonne per adattarle al formato atteso
         rename_map = {
@@ -171,21 +219,11 @@ class VictoriaMetricsService:
         if df.empty:
             return []
             
-        # Ordina per timestamp
+        # Ordina per timestamp e raggruppa per minuto come nella query Splunk:
+        # per ogni minuto l'ultimo valore non nullo di ogni colonna
         df = df.sort_values('time')
-        
-        # Raggruppa per minuto come nella query Splunk
-        df['minute'] = df['time'].dt.floor('min')
-        
-        # Latest per ogni minuto
-        latest_df = df.groupby('minute').agg({
-            'clientName': 'last',
-            'clientAddress': 'last',
-            'clientPlatform': 'last',
-            'clientVersion': 'last',
-            'connectionState': 'last',
-            'time': 'last'
-        }).reset_index()
+        minute = df['time'].dt.floor('min').rename('minute')
+        latest_df = df.groupby(minute)[_CHANGE_COLUMNS + ['time']].last().reset_index()
         
         # Filtra per stato connessione attiva o campi nulli come nella query Splunk
         mask = (latest_df['connectionState'] == 'Active') | (
@@ -197,42 +235,74 @@ class VictoriaMetricsService:
         latest_df = latest_df[mask]
         
         # Riempi i valori null con l'ultimo valore disponibile (filldown)
-        latest_df = latest_df.fillna(method='ffill')
+        latest_df = latest_df.ffill()
         
-        # Calcola i cambiamenti tra una riga e l'altra
-        events = []
-        prev_row = None
+        if latest_df.empty:
+            return []
         
-        for _, row in latest_df.iterrows():
-            if prev_row is not None:
-                changes = []
-                
-                # Controlla i cambiamenti come nella query Splunk
-                if row['clientName'] != prev_row['clientName']:
-                    changes.append("Client name change")
-                if row['clientAddress'] != prev_row['clientAddress']:
-                    changes.append("Client IP change")
-                if row['clientPlatform'] != prev_row['clientPlatform']:
-                    changes.append("Client platform change")
-                if row['clientVersion'] != prev_row['clientVersion']:
-                    changes.append("Client version change")
-                if row['connectionState'] != prev_row['connectionState']:
-                    changes.append("Connection state change")
-                
-                if changes:
-                    events.append(SessionEvent(
-                        time=row['time'].strftime("%Y-%m-%d %H:%M:%S"),
-                        session_changes=changes,
-                        client_name=row['clientName'],
-                        client_ip=row['clientAddress'],
-                        client_platform=row['clientPlatform'],
-                        client_version=row['clientVersion'],
-                        connection_state=row['connectionState']
-                    ))
+        # Calcola i cambiamenti rispetto alla riga precedente su tutte le colonne insieme:
+        # due valori mancanti non sono un cambiamento e la prima riga non ha un precedente
+        current = latest_df[_CHANGE_COLUMNS]
+        previous = current.shift(1)
+        changes_matrix = (current != previous) & ~(current.isna() & previous.isna())
+        changes_matrix.iloc[0] = False
+        
+        has_change = changes_matrix.any(axis=1)
+        changed_df = latest_df[has_change]
+        changes_matrix = changes_matrix[has_change]
+        
+        return _EVENTS_ADAPTER.validate_python([
+            {
+                'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'session_changes': [label for label, changed in zip(_CHANGE_LABELS, changes) if changed],
+                'client_name': client_name,
+                'client_ip': client_ip,
+                'client_platform': client_platform,
+                'client_version': client_version,
+                'connection_state': connection_state
+            }
+            for time, (client_name, client_ip, client_platform, client_version, connection_state), changes
+            in zip(changed_df['time'], self._client_rows(changed_df), changes_matrix.itertuples(index=False, name=None))
+        ])
+    
+    def _client_rows(self, df: pd.DataFrame) -> Iterator[ClientRow]:
+        """
+        Restituisce le colonne dei dati del client riga per riga, come tuple,
+        con None al posto dei valori mancanti (NaN)
+        
+        Args:
+            df: DataFrame con i dati della sessione
             
-            prev_row = row
+        Returns:
+            Iterator[ClientRow]: Tuple (clientName, clientAddress, clientPlatform, clientVersion, connectionState)
+        """
+        columns = df[_CHANGE_COLUMNS]
+        return columns.astype(object).where(columns.notna(), None).itertuples(index=False, name=None)
+    
+    def _dataframe_to_events(self, df: pd.DataFrame, change: str) -> List[SessionEvent]:
+        """
+        Crea un evento per ogni riga del DataFrame, con lo stesso cambiamento
         
-        return events
+        Args:
+            df: DataFrame con i dati della sessione
+            change: Descrizione del cambiamento
+            
+        Returns:
+            List[SessionEvent]: Un evento per riga
+        """
+        return _EVENTS_ADAPTER.validate_python([
+            {
+                'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'session_changes': [change],
+                'client_name': client_name,
+                'client_ip': client_ip,
+                'client_platform': client_platform,
+                'client_version': client_version,
+                'connection_state': connection_state
+            }
+            for time, (client_name, client_ip, client_platform, client_version, connection_state)
+            in zip(df['time'], self._client_rows(df))
+        ])
     
     async def _get_logon_events(self, session_guid: str, start_ts: int, end_ts: int) -> List[SessionEvent]:
         """
@@ -248,12 +318,12 @@ class VictoriaMetricsService:
         """
         # Query per gli eventi di logon
         query = f'''
-        citrix_session_logon{{sessionId="{session_guid}"}}[{start_ts}:{end_ts}]
+        citrix_session_logon{{sessionId="{session_guid}"}}
         '''
         
         try:
             # Esegui la query
-            raw_data = await self._execute_query(query)
+            raw_data = await self._execute_query(query, start_ts, end_ts)
             
             if not raw_data or not raw_data.get('data', {}).get('result'):
                 return []
@@ -265,19 +335,7 @@ class VictoriaMetricsService:
                 return []
                 
             # Crea eventi di logon
-            events = []
-            for _, row in df.iterrows():
-                events.append(SessionEvent(
-                    time=row['time'].strftime("%Y-%m-%d %H:%M:%S"),
-                    session_changes=["Session logon"],
-                    client_name=row.get('clientName'),
-                    client_ip=row.get('clientAddress'),
-                    client_platform=row.get('clientPlatform'),
-                    client_version=row.get('clientVersion'),
-                    connection_state=row.get('connectionState')
-                ))
-            
-            return events
+            return self._dataframe_to_events(df, "Session logon")
             
         except Exception as e:
             logger.error(f"Errore durante la raccolta degli eventi di logon: {str(e)}")
@@ -297,12 +355,12 @@ class VictoriaMetricsService:
         """
         # Query per gli eventi di logoff
         query = f'''
-        citrix_session_logoff{{sessionId="{session_guid}"}}[{start_ts}:{end_ts}]
+        citrix_session_logoff{{sessionId="{session_guid}"}}
         '''
         
         try:
             # Esegui la query
-            raw_data = await self._execute_query(query)
+            raw_data = await self._execute_query(query, start_ts, end_ts)
             
             if not raw_data or not raw_data.get('data', {}).get('result'):
                 return []
@@ -314,19 +372,7 @@ class VictoriaMetricsService:
                 return []
                 
             # Crea eventi di logoff
-            events = []
-            for _, row in df.iterrows():
-                events.append(SessionEvent(
-                    time=row['time'].strftime("%Y-%m-%d %H:%M:%S"),
-                    session_changes=["Session logoff"],
-                    client_name=row.get('clientName'),
-                    client_ip=row.get('clientAddress'),
-                    client_platform=row.get('clientPlatform'),
-                    client_version=row.get('clientVersion'),
-                    connection_state=row.get('connectionState')
-                ))
-            
-            return events
+            return self._dataframe_to_events(df, "Session logoff")
             
         except Exception as e:
             logger.error(f"Errore durante la raccolta degli eventi di logoff: {str(e)}")
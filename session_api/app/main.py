@@ -1,8 +1,9 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.routes import router as api_router
+from app.api.victoria_service import victoria_metrics_service
 from app.utils.config import CONFIG
 
 app = FastAPI(
@@ -23,10 +24,18 @@ app.add_middleware(
 # Include i router delle API
 app.include_router(api_router, prefix="/api")
 
-# Health check endpoint
+@app.on_event("shutdown")
+async def shutdown_client():
+    """Chiude il client HTTP condiviso verso VictoriaMetrics."""
+    await victoria_metrics_service.aclose()
+
+# Corpo fisso dell'health check, serializzato una sola volta
+HEALTH_BODY = b'{"status":"healthy"}'
+
+# Health check endpoint: async per non passare dal threadpool, senza serializzazione per richiesta
 @app.get("/health")
-def health_check():
-    return {"status": "healthy"}
+async def health_check():
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 if __name__ == "__main__":
     # Avvio del server
@@ -1,27 +1,63 @@
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, TypeAdapter, field_validator
 from datetime import datetime
 
+# Formato del GUID di sessione (UUID con trattini): la regex viene compilata da pydantic-core
+# una sola volta e blocca valori che finirebbero altrimenti nel selettore della query PromQL
+SESSION_GUID_PATTERN = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+
+# Parser ISO-8601 di pydantic, usato solo per le richieste con le vecchie date
+_DATETIME = TypeAdapter(datetime)
+
+
+def epoch_ms(value: Optional[datetime]) -> Optional[int]:
+    """
+    Converte una data in millisecondi Unix (le date senza fuso sono in ora locale)
+    
+    Args:
+        value: Data da convertire
+    
+    Returns:
+        Optional[int]: Millisecondi Unix, None se la data non e' indicata
+    """
+    return None if value is None else int(value.timestamp() * 1000)
+
 
 class SessionRequest(BaseModel):
     """
-    Modello per la richiesta di dati di sessione
+    Modello per la richiesta di dati di sessione.
+    Gli intervalli sono in millisecondi Unix; start_date/end_date in formato ISO
+    sono ancora accettati per compatibilita' e convertiti in millisecondi.
     """
-    session_guid: str = Field(..., description="GUID della sessione da interrogare")
-    start_date: Optional[datetime] = Field(
-        None, 
-        description="Data di inizio per il filtro (formato ISO)"
+    session_guid: str = Field(..., pattern=SESSION_GUID_PATTERN, description="GUID della sessione da interrogare")
+    start_ms: Optional[int] = Field(
+        None,
+        ge=0,
+        validation_alias=AliasChoices("start_ms", "start_date"),
+        description="Inizio del filtro in millisecondi Unix (o start_date in formato ISO)"
     )
-    end_date: Optional[datetime] = Field(
-        None, 
-        description="Data di fine per il filtro (formato ISO)"
+    end_ms: Optional[int] = Field(
+        None,
+        ge=0,
+        validation_alias=AliasChoices("end_ms", "end_date"),
+        description="Fine del filtro in millisecondi Unix (o end_date in formato ISO)"
     )
+    
+    @field_validator("start_ms", "end_ms", mode="before")
+    @classmethod
+    def _iso_to_ms(cls, value: Any) -> Any:
+        # I numeri passano direttamente alla validazione come int
+        if isinstance(value, datetime) or (isinstance(value, str) and not value.isdigit()):
+            return epoch_ms(_DATETIME.validate_python(value))
+        return value
 
 
 class SessionEvent(BaseModel):
     """
     Modello per un singolo evento di sessione
     """
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
     time: str = Field(..., description="Timestamp dell'evento")
     session_changes: List[str] = Field(..., description="Cambiamenti rilevati nella sessione")
     client_name: Optional[str] = Field(None, description="Nome del client")
@@ -35,6 +71,26 @@ class SessionResponse(BaseModel):
     """
     Modello per la risposta con i dati di sessione
     """
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
     session_guid: str = Field(..., description="GUID della sessione interrogata")
     events: List[SessionEvent] = Field(default_factory=list, description="Eventi della sessione")
-    metadata: Dict[str, Any] = Field(default_factory=dict, description="Metadati aggiuntivi")
\ No newline at end of file
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Metadati aggiuntivi")
+
+
+class SessionResponseColumnar(BaseModel):
+    """
+    Modello per la risposta con i dati di sessione in formato colonnare: un elenco
+    per ogni campo di SessionEvent, con gli eventi nello stesso ordine in tutti gli elenchi
+    """
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
+    session_guid: str = Field(..., description="GUID della sessione interrogata")
+    times: List[str] = Field(default_factory=list, description="Timestamp degli eventi")
+    session_changes: List[List[str]] = Field(default_factory=list, description="Cambiamenti rilevati per ogni evento")
+    client_names: List[Optional[str]] = Field(default_factory=list, description="Nomi del client")
+    client_ips: List[Optional[str]] = Field(default_factory=list, description="Indirizzi IP del client")
+    client_platforms: List[Optional[str]] = Field(default_factory=list, description="Piattaforme del client")
+    client_versions: List[Optional[str]] = Field(default_factory=list, description="Versioni del client")
+    connection_states: List[Optional[str]] = Field(default_factory=list, description="Stati della connessione")
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Metadati aggiuntivi")
@@ -1,34 +1,73 @@
 import os
 import logging
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
-# Configurazione del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+# Configurazione del logging: un solo handler con il suo formatter sul logger dell'applicazione,
+# aggiunto una volta sola anche se il modulo viene reimportato
 logger = logging.getLogger("session_api")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
 
+# Valori di DEBUG che attivano la modalita' debug
+_TRUTHY = frozenset({"1", "true", "True", "TRUE", "yes", "YES", "on", "ON"})
+
+@dataclass(frozen=True)
 class Config:
+    """
+    Configurazione letta dall'ambiente una sola volta all'avvio (vedi _load)
+    """
     # Server configuration
-    HOST: str = os.environ.get("HOST", "0.0.0.0")
-    PORT: int = int(os.environ.get("PORT", "8000"))
-    DEBUG: bool = os.environ.get("DEBUG", "False").lower() == "true"
+    HOST: str
+    PORT: int
+    DEBUG: bool
     
     # Victoria Metrics configuration
-    VICTORIA_METRICS_URL: str = os.environ.get("VICTORIA_METRICS_URL", "http://victoriametrics:8428")
+    VICTORIA_METRICS_URL: str
     
     # Log level
-    LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_LEVEL: str
+
+def _load() -> Config:
+    """
+    Legge le variabili d'ambiente e configura il livello del logger
+    
+    Returns:
+        Config: Configurazione immutabile
+    """
+    config = Config(
+        HOST=os.environ.get("HOST", "0.0.0.0"),
+        PORT=int(os.environ.get("PORT") or 8000),
+        DEBUG=os.environ.get("DEBUG", "").strip() in _TRUTHY,
+        VICTORIA_METRICS_URL=os.environ.get("VICTORIA_METRICS_URL", "http://victoriametrics:8428"),
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "INFO")
+    )
+    
+    # Set log level
+    logger.setLevel(getattr(logging, config.LOG_LEVEL))
+    
+    if config.DEBUG:
+        logger.info("Debug mode is enabled")
+        logger.info(f"Configuration: HOST={config.HOST}, PORT={config.PORT}")
+        logger.info(f"Victoria Metrics URL: {config.VICTORIA_METRICS_URL}")
+    
+    return config
+
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    """
+    Restituisce la configurazione, letta dall'ambiente alla prima chiamata.
+    Utilizzabile come dipendenza FastAPI (Depends(get_config)) senza rileggere l'ambiente.
     
-    def __init__(self):
-        # Set log level
-        logger.setLevel(getattr(logging, self.LOG_LEVEL))
-        
-        if self.DEBUG:
-            logger.info("Debug mode is enabled")
-            logger.info(f"Configuration: HOST={self.HOST}, PORT={self.PORT}")
-            logger.info(f"Victoria Metrics URL: {self.VICTORIA_METRICS_URL}")
+    Returns:
+        Config: Configurazione immutabile
+    """
+    return _load()
 
 # Singleton configuration instance
-CONFIG = Config()
\ No newline at end of file
+CONFIG = get_config()